@@ -0,0 +1,122 @@
+# analytics.py - Vectorized cohort, churn and lifetime value analytics
+#
+# Every function works on flat NumPy arrays with one element per subscription,
+# so computing the metrics is a handful of bincount/cumsum passes no matter how
+# many subscriptions there are. Months are integer indexes (year * 12 + month - 1)
+# and a subscription that has not churned has ``end == ACTIVE``.
+from lazy_imports import lazy_import
+
+# Loaded on first use so importing the app does not pay for NumPy
+np = lazy_import('numpy')
+
+ACTIVE = -1
+
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+
+def month_label(index):
+    year, month = divmod(int(index), 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+def _effective_end(end, now):
+    """End month with still-active subscriptions pushed past ``now``"""
+    return np.where(end == ACTIVE, now + 1, end)
+
+
+def cohort_retention(cohort, start, end, now, horizon=12):
+    """Retention matrix by cohort month.
+
+    A subscription counts as retained at age ``k`` (months after its cohort
+    month) when it had started and not yet churned in month ``cohort + k``.
+
+    Returns ``(cohorts, sizes, retention)`` where ``retention`` is a
+    ``len(cohorts) x (horizon + 1)`` float array and ages that lie in the
+    future are NaN.
+    """
+    cohort = np.asarray(cohort, dtype=np.int64)
+    if cohort.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, horizon + 1))
+
+    cohorts, row = np.unique(cohort, return_inverse=True)
+    width = horizon + 2  # one spare column absorbs events past the horizon
+    first_age = np.clip(np.asarray(start, dtype=np.int64) - cohort, 0, horizon + 1)
+    last_age = np.clip(_effective_end(np.asarray(end, dtype=np.int64), now) - cohort, 0, horizon + 1)
+
+    # +1 when the subscription becomes alive, -1 when it churns; a running sum
+    # along the age axis gives the number of live subscriptions at each age
+    size = len(cohorts) * width
+    deltas = np.bincount(row * width + first_age, minlength=size) - np.bincount(row * width + last_age, minlength=size)
+    alive = np.cumsum(deltas.reshape(len(cohorts), width), axis=1)[:, :horizon + 1]
+
+    sizes = np.bincount(row, minlength=len(cohorts))
+    retention = alive / sizes[:, None]
+    ages = np.arange(horizon + 1)
+    retention[cohorts[:, None] + ages[None, :] > now] = np.nan
+    return cohorts, sizes, retention
+
+
+def monthly_churn(start, end, first_month, last_month):
+    """Churn per calendar month.
+
+    Returns ``(months, active_at_start, churned, rate)`` for every month in
+    ``first_month..last_month``. ``rate`` is NaN when nothing was active.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    months = np.arange(first_month, last_month + 1)
+    span = len(months)
+
+    # Everything before the window collapses into slot 0 so it still counts
+    # towards the active base
+    started = np.bincount(np.clip(start - first_month + 1, 0, span), minlength=span + 1)
+    churned_mask = end != ACTIVE
+    ended = np.bincount(np.clip(end[churned_mask] - first_month + 1, 0, span + 1), minlength=span + 2)[:span + 1]
+
+    active_at_start = np.cumsum(started)[:span] - np.cumsum(ended)[:span]
+    churned = ended[1:span + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(active_at_start > 0, churned / active_at_start, np.nan)
+    return months, active_at_start, churned, rate
+
+
+def lifetime_value(group, start, end, mrr, now, window=12):
+    """Average revenue per subscription and simple LTV (ARPU / monthly churn) per group.
+
+    Churn is measured over the trailing ``window`` months as churned
+    subscriptions divided by active subscription-months. Returns
+    ``(groups, active, arpu, churn_rate, ltv)``; ``ltv`` is NaN when there was
+    no churn in the window.
+    """
+    group = np.asarray(group, dtype=np.int64)
+    if group.size == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), empty, empty, empty
+
+    start = np.asarray(start, dtype=np.int64)
+    end = _effective_end(np.asarray(end, dtype=np.int64), now)
+    mrr = np.asarray(mrr, dtype=np.float64)
+    groups, index = np.unique(group, return_inverse=True)
+
+    is_active = end > now
+    active = np.bincount(index, weights=is_active, minlength=len(groups)).astype(np.int64)
+    revenue = np.bincount(index, weights=mrr * is_active, minlength=len(groups))
+
+    window_start = now - window + 1
+    exposure = np.clip(np.minimum(end, now + 1) - np.maximum(start, window_start), 0, None)
+    churned_in_window = (end >= window_start) & (end <= now)
+    subscription_months = np.bincount(index, weights=exposure, minlength=len(groups))
+    churned = np.bincount(index, weights=churned_in_window, minlength=len(groups))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arpu = np.where(active > 0, revenue / active, np.nan)
+        churn_rate = np.where(subscription_months > 0, churned / subscription_months, np.nan)
+        ltv = np.where(churn_rate > 0, arpu / churn_rate, np.nan)
+    return groups, active, arpu, churn_rate, ltv
+
+
+def nan_to_none(values, digits=4):
+    """Round a float array for JSON output, mapping NaN to None"""
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
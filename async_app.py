@@ -0,0 +1,251 @@
+# async_app.py - asyncio serving path for the hottest read endpoints
+#
+# A small ASGI application answering the plan list, coupon validation and user
+# subscription reads from async SQLAlchemy sessions, so one process keeps
+# thousands of requests in flight while they wait on the database instead of
+# holding a thread each. Responses are byte-for-byte the shapes the Flask
+# routes return; every other path is left to the Flask app, so put this behind
+# the same proxy and route only these paths here:
+#
+#   GET  /api/plans
+#   POST /api/coupons/<code>/validate
+#   GET  /api/users/<id>/subscriptions
+#
+# HEAD, OPTIONS and the CORS headers are answered the way Flask and
+# flask_cors.CORS(app) answer them, so these paths may receive browser
+# preflights too. Requests are recorded in the same metrics as the Flask routes
+# (same route labels) and served at METRICS_PATH. Run with any ASGI server, e.g.
+# `python start.py serve-async` (uvicorn --factory async_app:create_async_app).
+import re
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import metrics
+import serializers
+from app import create_app
+from models import Coupon, Plan, Subscription, User
+
+# Synchronous driver -> asyncio driver for the same database
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+# flask_cors defaults: every origin, method and request header is allowed
+CORS_ALLOW_METHODS = b'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+
+
+def cors_headers(request):
+    """The headers flask_cors.CORS(app) adds to a response for ``request``"""
+    origin = request.headers.get(b'origin')
+    headers = [(b'access-control-allow-origin', origin or b'*')]
+    if request.method == 'OPTIONS' and b'access-control-request-method' in request.headers:
+        requested = request.headers.get(b'access-control-request-headers', b'')
+        names = sorted(name.strip() for name in requested.decode('latin-1').split(',') if name.strip())
+        if names:
+            headers.append((b'access-control-allow-headers', ', '.join(names).encode('latin-1')))
+        headers.append((b'access-control-allow-methods', CORS_ALLOW_METHODS))
+    if origin is not None:
+        headers.append((b'vary', b'Origin'))
+    return headers
+
+
+def async_database_uri(config):
+    """ASYNC_DATABASE_URI, or SQLALCHEMY_DATABASE_URI switched to its asyncio driver"""
+    if config.get('ASYNC_DATABASE_URI'):
+        return config['ASYNC_DATABASE_URI']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is None:
+        raise RuntimeError(f"No asyncio driver known for {url.drivername}; set ASYNC_DATABASE_URI")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers')
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = dict(scope.get('headers', ()))
+        self.query = {key: values[-1] for key, values in
+                      parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+
+class AsyncReadApp:
+    """ASGI callable serving the read endpoints above"""
+
+    def __init__(self, config):
+        self.config = config
+        self.engine = None
+        self.sessions = None
+        # (method, path pattern, handler, the Flask rule, used as the metrics route label)
+        self.routes = [
+            ('GET', re.compile(r'/api/plans'), self.get_plans, '/api/plans'),
+            ('POST', re.compile(r'/api/coupons/(?P<code>[^/]+)/validate'), self.validate_coupon,
+             '/api/coupons/<code>/validate'),
+            ('GET', re.compile(r'/api/users/(?P<user_id>\d+)/subscriptions'), self.get_user_subscriptions,
+             '/api/users/<int:user_id>/subscriptions'),
+        ]
+        self.metrics_path = config['METRICS_PATH'] if metrics.configure(config) else None
+
+    def start(self):
+        if self.engine is not None:
+            return
+        options = {}
+        if not self.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            # Requests beyond the pool wait (without a thread) for a connection
+            options = {'pool_size': self.config['ASYNC_POOL_SIZE'],
+                       'max_overflow': self.config['ASYNC_MAX_OVERFLOW'],
+                       'pool_timeout': 30, 'pool_recycle': 3600, 'pool_pre_ping': True}
+        self.engine = create_async_engine(async_database_uri(self.config), **options)
+        # Rows are serialized right after the query; nothing is written back
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False, autoflush=False)
+
+    async def stop(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        request = Request(scope)
+        if request.path == self.metrics_path and request.method in ('GET', 'HEAD'):
+            await self.respond(request, send, 200, metrics.render().encode(), metrics.CONTENT_TYPE.encode())
+            return
+
+        rule, handler, params, allowed = self.resolve(request.path)
+        labels = (request.method, rule)
+        start = metrics.start_request(labels) if self.metrics_path is not None else None
+        status, failed = 500, False
+        try:
+            try:
+                status, payload, content_type, headers = await self.dispatch(request, handler, params, allowed)
+            except Exception as e:
+                status, payload, content_type, headers = 500, {'error': str(e)}, b'application/json', []
+                failed = True
+            body = b'' if payload is None else serializers.dumps(payload)
+            await self.respond(request, send, status, body, content_type, headers)
+        finally:
+            if start is not None:
+                metrics.finish_request(labels, start, status, failed)
+
+    def resolve(self, path):
+        """``(route label, handler, path parameters, allowed methods)``; 'unmatched' for unknown paths"""
+        for method, pattern, handler, rule in self.routes:
+            match = pattern.fullmatch(path)
+            if match is not None:
+                # Like Flask: GET routes answer HEAD, and every route answers OPTIONS
+                allowed = {method, 'OPTIONS'} | ({'HEAD'} if method == 'GET' else set())
+                # scope['path'] is already percent-decoded, as PATH_INFO is for Flask
+                return rule, handler, match.groupdict(), allowed
+        return 'unmatched', None, {}, set()
+
+    async def dispatch(self, request, handler, params, allowed):
+        """``(status, payload, content type, extra headers)`` for a resolved request"""
+        if handler is None:
+            return 404, {'error': 'Not found'}, b'application/json', []
+        allow = [(b'allow', ', '.join(sorted(allowed)).encode())]
+        if request.method == 'OPTIONS':
+            return 200, None, b'text/html; charset=utf-8', allow
+        if request.method not in allowed:
+            return 405, {'error': 'Method not allowed'}, b'application/json', allow
+        self.start()
+        status, payload = await handler(request, **params)
+        return status, payload, b'application/json', []
+
+    async def respond(self, request, send, status, body, content_type, headers=()):
+        headers = [(b'content-type', content_type), (b'content-length', str(len(body)).encode()), *headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers + cors_headers(request)})
+        await send({'type': 'http.response.body', 'body': b'' if request.method == 'HEAD' else body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.start()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ---------------- Endpoints ---------------- #
+    async def get_plans(self, request):
+        try:
+            fields = serializers.PLAN.parse_fields(request.query.get('fields') or request.query.get('columns'))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        async with self.sessions() as session:
+            plans = (await session.scalars(select(Plan).filter_by(active=True))).all()
+        return 200, serializers.PLAN.dump_many(plans, fields or serializers.PLAN_FIELDS)
+
+    async def validate_coupon(self, request, code):
+        async with self.sessions() as session:
+            coupon = (await session.scalars(select(Coupon).filter_by(code=code, active=True).limit(1))).first()
+
+        if not coupon:
+            return 404, {'valid': False, 'error': 'Coupon not found'}
+
+        now = datetime.utcnow()
+        if coupon.valid_until and now > coupon.valid_until:
+            return 400, {'valid': False, 'error': 'Coupon expired'}
+
+        if coupon.max_uses and coupon.current_uses >= coupon.max_uses:
+            return 400, {'valid': False, 'error': 'Coupon usage limit reached'}
+
+        payload = {'valid': True}
+        payload.update(serializers.COUPON.dump(coupon, serializers.COUPON_VALIDATION_FIELDS))
+        return 200, payload
+
+    async def get_user_subscriptions(self, request, user_id):
+        user_id = int(user_id)
+        async with self.sessions() as session:
+            if await session.get(User, user_id) is None:
+                return 404, {'error': 'User not found'}
+            subscriptions = (await session.scalars(select(Subscription).filter_by(user_id=user_id))).all()
+            plan_ids = {sub.plan_id for sub in subscriptions}
+            plans = (await session.scalars(select(Plan).where(Plan.id.in_(plan_ids)))).all() if plan_ids else []
+
+        serialize = serializers.SUBSCRIPTION.compile(serializers.USER_SUBSCRIPTION_FIELDS)
+        serialize_plan = serializers.PLAN.compile(serializers.PLAN_SUMMARY_FIELDS)
+        summaries = {plan.id: serialize_plan(plan) for plan in plans}
+        result = []
+        for sub in subscriptions:
+            payload = serialize(sub)
+            payload['plan'] = summaries[sub.plan_id]
+            result.append(payload)
+        return 200, result
+
+
+def create_async_app(config=None):
+    """Build the ASGI app from the Flask app's configuration (``config`` overrides it)"""
+    return AsyncReadApp(create_app(config).config)
+
+
+def __getattr__(name):
+    """``async_app.app`` is built on first access, like ``app.app``"""
+    global app
+    if name == 'app':
+        app = create_async_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
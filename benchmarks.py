@@ -0,0 +1,226 @@
+# benchmarks.py - In-process microbenchmarks for hot code paths
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import serializers
+
+
+def _timeit(func, repeat=5):
+    """Best wall-clock time of ``repeat`` runs, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _report(label, seconds, rows):
+    print(f"   {label:<32} {seconds * 1000:9.2f}ms total  {seconds / rows * 1e6:7.3f}us/row")
+
+
+def _sample_subscriptions(rows):
+    now = datetime.utcnow()
+    return [SimpleNamespace(
+        id=i,
+        user_id=i % 1000,
+        plan_id=i % 4,
+        stripe_subscription_id=f"sub_{i:012d}",
+        status='active' if i % 7 else 'canceled',
+        quantity=1 + i % 3,
+        current_period_start=now,
+        current_period_end=now + timedelta(days=30),
+        cancel_at_period_end=False,
+        trial_end=None if i % 2 else now + timedelta(days=14),
+        canceled_at=None,
+        created_at=now,
+        updated_at=now,
+    ) for i in range(rows)]
+
+
+def _sample_plans(rows):
+    now = datetime.utcnow()
+    return [SimpleNamespace(
+        id=i,
+        name=f"Plan {i}",
+        description='Benchmark plan',
+        amount=Decimal('29.99'),
+        interval='monthly',
+        features=['5 Projects', '10GB Storage'],
+        active=True,
+        trial_days=7,
+        setup_fee=Decimal('0'),
+        stripe_price_id=f"price_{i}",
+        stripe_product_id=f"prod_{i}",
+        created_at=now,
+    ) for i in range(rows)]
+
+
+def bench_serialization(rows=20000):
+    """Compare hand-built dicts + stdlib json with the precompiled serializers"""
+    print("\n" + "="*80)
+    print(f"⚡ SERIALIZATION BENCHMARK ({rows} rows, backend: {serializers.JSON_BACKEND})")
+    print("="*80)
+
+    subscriptions = _sample_subscriptions(rows)
+    plans = _sample_plans(rows)
+
+    def manual_subscriptions():
+        json.dumps([{
+            'id': sub.id,
+            'status': sub.status,
+            'quantity': sub.quantity,
+            'current_period_start': sub.current_period_start.isoformat() if sub.current_period_start else None,
+            'current_period_end': sub.current_period_end.isoformat() if sub.current_period_end else None,
+            'cancel_at_period_end': sub.cancel_at_period_end,
+            'trial_end': sub.trial_end.isoformat() if sub.trial_end else None,
+            'stripe_subscription_id': sub.stripe_subscription_id,
+            'created_at': sub.created_at.isoformat()
+        } for sub in subscriptions])
+
+    def compiled_subscriptions():
+        serializers.dumps(serializers.SUBSCRIPTION.dump_many(subscriptions, serializers.USER_SUBSCRIPTION_FIELDS))
+
+    def manual_plans():
+        json.dumps([{
+            'id': plan.id,
+            'name': plan.name,
+            'description': plan.description,
+            'amount': float(plan.amount),
+            'interval': plan.interval,
+            'features': plan.features,
+            'trial_days': plan.trial_days,
+            'setup_fee': float(plan.setup_fee),
+            'stripe_price_id': plan.stripe_price_id
+        } for plan in plans])
+
+    def compiled_plans():
+        serializers.dumps(serializers.PLAN.dump_many(plans, serializers.PLAN_FIELDS))
+
+    def compiled_subscriptions_dicts_only():
+        serializers.SUBSCRIPTION.dump_many(subscriptions, serializers.USER_SUBSCRIPTION_FIELDS)
+
+    print("\n📋 Subscriptions")
+    _report("hand-built dicts + json.dumps", _timeit(manual_subscriptions), rows)
+    _report("compiled serializer (dicts only)", _timeit(compiled_subscriptions_dicts_only), rows)
+    _report("compiled serializer + dumps", _timeit(compiled_subscriptions), rows)
+
+    print("\n📋 Plans")
+    _report("hand-built dicts + json.dumps", _timeit(manual_plans), rows)
+    _report("compiled serializer + dumps", _timeit(compiled_plans), rows)
+
+
+def bench_cohorts(rows=2000000):
+    """Cohort retention, churn and LTV over synthetic subscriptions"""
+    import numpy as np
+    import analytics
+
+    print("\n" + "="*80)
+    print(f"📊 COHORT ANALYTICS BENCHMARK ({rows} subscriptions)")
+    print("="*80)
+
+    rng = np.random.default_rng(42)
+    now = analytics.month_index(2025, 12)
+    cohort = rng.integers(now - 60, now + 1, rows)
+    start = cohort + rng.integers(0, 3, rows)
+    lifetime = rng.geometric(0.05, rows)
+    end = np.where(start + lifetime <= now, start + lifetime, analytics.ACTIVE)
+    plan = rng.integers(1, 9, rows)
+    mrr = rng.choice([9.99, 29.99, 99.99], rows)
+
+    print()
+    _report("cohort_retention (24 months)", _timeit(lambda: analytics.cohort_retention(cohort, start, end, now, 24)), rows)
+    _report("monthly_churn (60 months)", _timeit(lambda: analytics.monthly_churn(start, end, now - 59, now)), rows)
+    _report("lifetime_value (8 plans)", _timeit(lambda: analytics.lifetime_value(plan, start, end, mrr, now)), rows)
+
+
+# Budgets (seconds, median of the runs) for a cold interpreter; bench_startup
+# fails when one is exceeded
+STARTUP_BUDGETS = {'import': 0.75, 'create_app': 0.1, 'first_request': 0.15}
+# Heavy dependencies that must not be loaded by importing the app, creating it
+# or serving a plain read, and a submodule that only exists once they are
+STARTUP_LAZY_MODULES = {'stripe': 'stripe.api_resources', 'numpy': 'numpy.linalg', 'pyarrow': 'pyarrow.lib'}
+
+_STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+created = time.perf_counter()
+with application.app_context():
+    app.db.create_all()
+client = application.test_client()
+ready = time.perf_counter()
+status = client.get('/api/plans').status_code
+first = time.perf_counter()
+client.get('/api/plans')
+second = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': first - ready, 'second_request': second - first, 'status': status,
+                  'loaded': [name for name, marker in %r.items() if marker in sys.modules]}))
+'''
+
+
+def bench_startup(runs=5):
+    """App import, create_app() and first-request latency in fresh interpreters"""
+    print("\n" + "="*80)
+    print(f"🚀 STARTUP BENCHMARK ({runs} cold starts)")
+    print("="*80)
+
+    script = _STARTUP_SCRIPT % STARTUP_LAZY_MODULES
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    ok = True
+    print()
+    for phase in ('import', 'create_app', 'first_request', 'second_request'):
+        median = statistics.median(sample[phase] for sample in samples)
+        budget = STARTUP_BUDGETS.get(phase)
+        verdict = '' if budget is None else ('[OK]' if median <= budget else '[SLOW]')
+        ok = ok and verdict != '[SLOW]'
+        limit = f"(budget {budget * 1000:.0f}ms)" if budget is not None else ''
+        print(f"   {phase:<32} {median * 1000:9.2f}ms median  {verdict} {limit}")
+
+    statuses = {sample['status'] for sample in samples}
+    if statuses != {200}:
+        print(f"   [ERROR] first request returned {sorted(statuses)}")
+        ok = False
+    loaded = sorted({name for sample in samples for name in sample['loaded']})
+    if loaded:
+        print(f"   [SLOW] loaded at startup: {', '.join(loaded)}")
+        ok = False
+    else:
+        print(f"   [OK] not loaded at startup: {', '.join(STARTUP_LAZY_MODULES)}")
+    return ok
+
+
+BENCHMARKS = {
+    'serialization': bench_serialization,
+    'cohorts': bench_cohorts,
+    'startup': bench_startup,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in BENCHMARKS:
+        args = [int(arg) for arg in sys.argv[2:]]
+        if BENCHMARKS[sys.argv[1]](*args) is False:
+            sys.exit(1)
+    elif len(sys.argv) > 1:
+        print("Available benchmarks:")
+        for name, func in BENCHMARKS.items():
+            print(f"  {name} - {func.__doc__}")
+    else:
+        results = [func() for func in BENCHMARKS.values()]
+        if False in results:
+            sys.exit(1)
@@ -0,0 +1,67 @@
+# conftest.py - pytest fixtures: the app on a throwaway SQLite database
+#
+# test_complete.py exercises a running server over HTTP; the pytest suites
+# build the app in-process with create_app() and need no server or Stripe.
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+import quotas
+from models import db, Plan, Subscription, User
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """``make_app(**config)`` builds an app on a fresh database under ``tmp_path``"""
+    # Per-process singletons would otherwise leak between tests
+    monkeypatch.setattr(app_module, '_usage_aggregator', None)
+    monkeypatch.setattr(app_module, '_segment_store', None)
+    monkeypatch.setattr(app_module, '_idempotency_filter', None)
+    monkeypatch.setattr(app_module, 'quota_cache', quotas.QuotaCache(
+        app_module._quota_subscription, app_module.plan_limits, app_module._quota_usage))
+
+    def build(**config):
+        flask_app = app_module.create_app(dict({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+            'USAGE_JOURNAL_DIR': str(tmp_path / 'usage-journal'),
+            'USAGE_SEGMENT_DIR': str(tmp_path / 'usage-segments'),
+            'EXPORT_DIR': str(tmp_path / 'exports'),
+            'SNAPSHOT_DIR': str(tmp_path / 'snapshots'),
+            'METRICS_ENABLED': False,
+        }, **config))
+        with flask_app.app_context():
+            db.create_all()
+        return flask_app
+
+    return build
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def make_subscription():
+    """``make_subscription(period_start=None, **columns)`` inserts a user, plan and subscription; returns its id.
+
+    Call it inside an app context. The billing period runs 30 days from
+    ``period_start`` (default: now).
+    """
+    def create(period_start=None, limits=None, **columns):
+        period_start = period_start or datetime.utcnow()
+        user = User(email=f"user{User.query.count()}@example.com", name='Test User')
+        plan = Plan(name='Test Plan', amount=10, interval='monthly')
+        db.session.add_all([user, plan])
+        db.session.flush()
+        for metric_name, limit in (limits or {}).items():
+            db.session.add(app_module.PlanLimit(plan_id=plan.id, metric_name=metric_name, limit_value=limit))
+        subscription = Subscription(user_id=user.id, plan_id=plan.id, status='active',
+                                    current_period_start=period_start,
+                                    current_period_end=period_start + timedelta(days=30), **columns)
+        db.session.add(subscription)
+        db.session.commit()
+        return subscription.id
+
+    return create
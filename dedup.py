@@ -0,0 +1,106 @@
+# dedup.py - Bounded-memory, time-windowed membership filters for idempotency keys
+#
+# A Bloom filter answers "definitely not seen" or "maybe seen" in constant
+# memory. RotatingBloomFilter keeps a few of them, each covering a slice of the
+# window, and drops the oldest as time moves on, so memory stays bounded and
+# keys age out. Filters only ever produce false positives: a "maybe" must be
+# confirmed against the database, a "no" never needs to be.
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+def key_hashes(keys):
+    """Two independent 64-bit hashes per key (the second forced odd)"""
+    digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest() for key in keys)
+    pairs = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1] | np.uint64(1)
+
+
+class BloomFilter:
+    """Bit array Bloom filter with double hashing, vectorized over key batches"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, h1, h2):
+        rounds = np.arange(self.hash_count, dtype=np.uint64)
+        # uint64 arithmetic wraps around, which is what double hashing wants
+        return ((h1[:, None] + rounds[None, :] * h2[:, None]) % np.uint64(self.size)).astype(np.int64)
+
+    def add_hashes(self, h1, h2):
+        positions = self._positions(h1, h2).ravel()
+        np.bitwise_or.at(self.bits, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+        self.count += len(h1)
+
+    def contains_hashes(self, h1, h2):
+        positions = self._positions(h1, h2)
+        return ((self.bits[positions >> 3] >> (positions & 7)) & 1).astype(bool).all(axis=1)
+
+
+class RotatingBloomFilter:
+    """Remembers keys for at least ``window_seconds`` in bounded memory.
+
+    ``generations`` filters each cover ``window / (generations - 1)`` seconds,
+    so the live filters together always span at least the full window.
+    Thread safe.
+    """
+
+    def __init__(self, window_seconds, capacity, generations=4, error_rate=0.001, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.generations = generations
+        self.slice_seconds = window_seconds / (generations - 1)
+        self.generation_capacity = max(1, capacity // (generations - 1))
+        self.error_rate = error_rate
+        self.clock = clock
+        self.filters = deque(maxlen=generations)
+        self._rotated_at = None
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        now = self.clock()
+        if self._rotated_at is None:
+            elapsed, self._rotated_at = self.generations, now
+        else:
+            elapsed = int((now - self._rotated_at) // self.slice_seconds)
+            # Advance by whole slices so generation boundaries do not drift later
+            self._rotated_at += elapsed * self.slice_seconds
+        for _ in range(min(elapsed, self.generations)):
+            self.filters.append(BloomFilter(self.generation_capacity, self.error_rate))
+
+    def might_contain(self, keys):
+        """Boolean array: False means the key was definitely not added within the window"""
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        h1, h2 = key_hashes(keys)
+        with self._lock:
+            self._rotate()
+            hits = np.zeros(len(keys), dtype=bool)
+            for bloom in self.filters:
+                hits |= bloom.contains_hashes(h1, h2)
+            return hits
+
+    def add(self, keys):
+        if not keys:
+            return
+        h1, h2 = key_hashes(keys)
+        with self._lock:
+            self._rotate()
+            self.filters[-1].add_hashes(h1, h2)
+
+    def status(self):
+        with self._lock:
+            return {
+                'window_seconds': self.window_seconds,
+                'generations': len(self.filters),
+                'keys': [bloom.count for bloom in self.filters],
+                'bytes': sum(bloom.bits.nbytes for bloom in self.filters),
+            }
@@ -0,0 +1,172 @@
+# exporters.py - Incremental export writers
+#
+# Writers take an iterable of row batches and yield encoded chunks, one per
+# batch, so an export of any size is held in memory one batch at a time. Text
+# formats receive serialized dicts; Parquet receives the raw column values and
+# writes every batch as one row group.
+import csv
+import io
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+import serializers
+from lazy_imports import lazy_import
+
+# Parquet export is optional (None when pyarrow is not installed); pyarrow is
+# only loaded when a Parquet export runs
+pyarrow = lazy_import('pyarrow')
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+
+def iter_csv(batches, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(batches):
+    for batch in batches:
+        if batch:
+            yield b'\n'.join(serializers.dumps(row) for row in batch) + b'\n'
+
+
+def iter_json_array(batches):
+    """A single JSON array, streamed"""
+    separator = b'['
+    for batch in batches:
+        if batch:
+            yield separator + b','.join(serializers.dumps(row) for row in batch)
+            separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+
+# format -> (writer(batches, fields), content type, file extension)
+TEXT_FORMATS = {
+    'csv': (iter_csv, 'text/csv', 'csv'),
+    'ndjson': (lambda batches, fields: iter_ndjson(batches), 'application/x-ndjson', 'ndjson'),
+    'json': (lambda batches, fields: iter_json_array(batches), 'application/json', 'json'),
+}
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are drained after every row group"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_column(column):
+    """(pyarrow type, value converter) for a SQLAlchemy column"""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if python_type is bool:
+        return pyarrow.bool_(), None
+    if python_type is int:
+        return pyarrow.int64(), None
+    if python_type is float:
+        return pyarrow.float64(), None
+    if python_type is Decimal:
+        return pyarrow.float64(), serializers.number
+    if python_type is datetime:
+        return pyarrow.timestamp('us'), None
+    if python_type is date:
+        return pyarrow.date32(), None
+    if python_type is str:
+        return pyarrow.string(), None
+    # JSON and anything else is written as its JSON text
+    return pyarrow.string(), lambda value: None if value is None else serializers.dumps(value).decode('utf-8')
+
+
+def iter_parquet(batches, columns, compression='snappy'):
+    """Parquet file from batches of raw row tuples in ``columns`` order, one row group per batch"""
+    if pyarrow is None:
+        raise RuntimeError('Parquet export requires pyarrow')
+    import pyarrow.parquet as parquet
+    types = [_arrow_column(column) for column in columns]
+    schema = pyarrow.schema([(column.name, arrow_type) for column, (arrow_type, _) in zip(columns, types)])
+    sink = _ChunkSink()
+    writer = parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema, compression=compression)
+    try:
+        for batch in batches:
+            if not batch:
+                continue
+            arrays = []
+            for values, (arrow_type, convert) in zip(zip(*batch), types):
+                if convert is not None:
+                    values = [convert(value) for value in values]
+                arrays.append(pyarrow.array(values, type=arrow_type))
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def zstd_chunks(chunks, level=3):
+    if zstandard is None:
+        raise RuntimeError('zstd compression requires zstandard')
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# compression -> (stream wrapper, content type, file extension suffix)
+COMPRESSIONS = {
+    'gzip': (gzip_chunks, 'application/gzip', '.gz'),
+    'zstd': (zstd_chunks, 'application/zstd', '.zst'),
+}
+
+
+def available_formats():
+    return list(TEXT_FORMATS) + (['parquet'] if pyarrow is not None else [])
+
+
+def available_compressions():
+    return ['gzip'] + (['zstd'] if zstandard is not None else [])
@@ -0,0 +1,59 @@
+# gunicorn.conf.py - Production server settings (python start.py serve)
+#
+# Every setting can be overridden from the environment. Background jobs are
+# not run by the web workers; run `flask --app app run-jobs` in one dedicated
+# process next to the server.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+# Prefork workers; each serves `threads` requests at a time
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Import the app once in the master so workers fork with it already loaded.
+# HUP restarts the workers gracefully from the loaded code; deploy new code
+# with USR2 (start a new master) followed by TERM to the old one.
+preload_app = True
+pidfile = os.environ.get('GUNICORN_PIDFILE', 'gunicorn.pid')
+
+# Recycle each worker after this many requests (jittered so they do not all
+# restart at once) to bound slow memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+
+# Workers share their Prometheus metrics through this directory
+os.environ.setdefault('METRICS_MULTIPROCESS_DIR', os.path.join(tempfile.gettempdir(), 'subscription-metrics'))
+
+
+def on_starting(server):
+    # Start counting from zero, as a restarted single process would
+    shutil.rmtree(os.environ['METRICS_MULTIPROCESS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_MULTIPROCESS_DIR'], exist_ok=True)
+
+
+def when_ready(server):
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+        # Connections opened by the master must not be shared with the workers
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    from app import app, background_jobs, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+    # Each worker flushes its own usage aggregator
+    job = background_jobs.jobs.get('usage-flush')
+    if job is not None:
+        job.start(app)
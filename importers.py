@@ -0,0 +1,184 @@
+# importers.py - Record readers and field coercion for bulk imports
+#
+# Readers turn a binary CSV or NDJSON stream into (line_number, record, error)
+# tuples one line at a time, so an import of any size is parsed in constant
+# memory. Every importable entity declares its fields once as name -> parser;
+# CSV strings and JSON values are coerced to the same Python types, and
+# columns that are not declared (such as ``id`` or ``mrr`` in a file produced
+# by the export endpoints) are ignored.
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from usage import iter_ndjson, parse_timestamp
+
+_TRUE = {'true', 't', 'yes', 'y', '1'}
+_FALSE = {'false', 'f', 'no', 'n', '0'}
+
+
+def text(max_length=None):
+    def parse(value):
+        if not isinstance(value, str):
+            raise ValueError('must be a string')
+        if max_length is not None and len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return parse
+
+
+def integer(value):
+    if isinstance(value, bool):
+        raise ValueError('must be an integer')
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError('must be an integer')
+        return int(value)
+    return int(value)
+
+
+def decimal(value):
+    if isinstance(value, bool):
+        raise ValueError('must be a number')
+    try:
+        parsed = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('must be a number')
+    if not parsed.is_finite():
+        raise ValueError('must be a finite number')
+    return parsed
+
+
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in _TRUE | _FALSE:
+        return value.lower() in _TRUE
+    raise ValueError('must be true or false')
+
+
+def timestamp(value):
+    try:
+        return parse_timestamp(value, None)
+    except (TypeError, OverflowError, OSError):
+        raise ValueError('must be an ISO-8601 timestamp')
+
+
+def string_list(value):
+    """A JSON array of strings; in CSV either a JSON array or ``a;b;c``"""
+    if isinstance(value, str):
+        value = json.loads(value) if value.startswith('[') else [item.strip() for item in value.split(';')]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('must be a list of strings')
+    return [item for item in value if item]
+
+
+class RecordSchema:
+    """Coerces raw records of one entity to ``{field: value}`` dicts"""
+
+    def __init__(self, name, fields, required=()):
+        self.name = name
+        self.fields = dict(fields)
+        self.required = tuple(required)
+
+    def coerce(self, record):
+        """Parsed values of every declared field (missing and empty ones are None).
+
+        Raises ValueError naming the first field that fails.
+        """
+        if not isinstance(record, dict):
+            raise ValueError(f'{self.name} must be an object')
+        values = {}
+        for field, parse in self.fields.items():
+            value = record.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == '':
+                values[field] = None
+                continue
+            try:
+                values[field] = parse(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f'{field} {e}' if str(e).startswith('must') else f'{field} is invalid')
+        missing = [field for field in self.required if values[field] is None]
+        if missing:
+            raise ValueError(f"{', '.join(missing)} required")
+        return values
+
+
+USER = RecordSchema('User', {
+    'email': text(120),
+    'name': text(100),
+    'stripe_customer_id': text(100),
+    'phone': text(20),
+    'company': text(100),
+    'status': text(20),
+    'created_at': timestamp,
+    'last_login': timestamp,
+}, required=('email', 'name'))
+
+PLAN = RecordSchema('Plan', {
+    'name': text(100),
+    'description': text(),
+    'amount': decimal,
+    'interval': text(20),
+    'stripe_price_id': text(100),
+    'stripe_product_id': text(100),
+    'features': string_list,
+    'active': boolean,
+    'trial_days': integer,
+    'setup_fee': decimal,
+    'usage_metric': text(100),
+}, required=('name', 'amount'))
+
+# The user is given by user_id or user_email, the plan by plan_id or
+# stripe_price_id and the coupon, if any, by coupon_id or coupon_code
+SUBSCRIPTION = RecordSchema('Subscription', {
+    'user_id': integer,
+    'user_email': text(120),
+    'plan_id': integer,
+    'stripe_price_id': text(100),
+    'stripe_subscription_id': text(100),
+    'stripe_subscription_item_id': text(100),
+    'status': text(50),
+    'quantity': integer,
+    'current_period_start': timestamp,
+    'current_period_end': timestamp,
+    'cancel_at_period_end': boolean,
+    'trial_end': timestamp,
+    'canceled_at': timestamp,
+    'coupon_id': integer,
+    'coupon_code': text(50),
+    'raw_usage': boolean,
+    'created_at': timestamp,
+})
+
+FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+
+def iter_csv(stream):
+    """Yield ``(line_number, record, error)`` for every row of a CSV stream with a header row"""
+    reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, f'Invalid CSV: {e}'
+            continue
+        except UnicodeDecodeError:
+            yield reader.line_num + 1, None, 'Invalid UTF-8'
+            return
+        if None in record:
+            yield reader.line_num, None, 'More values than header columns'
+        else:
+            yield reader.line_num, record, None
+
+
+def iter_records(stream, import_format, loads=json.loads):
+    if import_format == 'csv':
+        return iter_csv(stream)
+    if import_format == 'ndjson':
+        return iter_ndjson(stream, loads)
+    raise ValueError(f"format must be one of: {', '.join(FORMATS.values())}")
@@ -0,0 +1,120 @@
+# jobs.py - Lightweight in-process background jobs
+import threading
+import time
+import traceback
+
+
+class PeriodicJob:
+    """Runs ``func()`` inside the Flask app context every ``interval`` seconds.
+
+    The job runs on a daemon thread. A failing run is logged and retried on
+    the next tick, so one bad run never stops the schedule. ``stop()`` wakes
+    the thread immediately instead of waiting out the interval.
+    """
+
+    def __init__(self, name, func, interval, run_immediately=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_immediately = run_immediately
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, app):
+        start = time.monotonic()
+        try:
+            with app.app_context():
+                self.func()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[JOB] {self.name} failed: {e}")
+            traceback.print_exc()
+        finally:
+            self.last_run = time.time()
+            self.last_duration = time.monotonic() - start
+            self.runs += 1
+
+    def _loop(self, app):
+        if not self.run_immediately:
+            self._stop.wait(self.interval)
+        while not self._stop.is_set():
+            self.run_once(app)
+            self._stop.wait(self.interval)
+
+    def start(self, app):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(app,), name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+        }
+
+
+class JobRegistry:
+    """Named set of periodic jobs started and stopped together"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add(self, job):
+        self.jobs[job.name] = job
+        return job
+
+    def start_all(self, app):
+        for job in self.jobs.values():
+            job.start(app)
+
+    def stop_all(self, timeout=None):
+        for job in self.jobs.values():
+            job.stop(timeout)
+
+    def status(self):
+        return [job.status() for job in self.jobs.values()]
+
+
+class RateLimiter:
+    """Token bucket shared by threads; ``acquire()`` blocks until a call may proceed"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
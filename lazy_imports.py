@@ -0,0 +1,24 @@
+# lazy_imports.py - Deferred imports of heavy optional dependencies
+#
+# ``lazy_import(name)`` returns a module object whose code only runs on the
+# first attribute access, so importing the app (or forking a worker) does not
+# pay for stripe, numpy or pyarrow until a request actually uses them.
+# Setting attributes (such as ``stripe.api_key``) does not trigger the import.
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """``name`` as a lazily executed module, or None when it is not installed"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,421 @@
+# metrics.py - In-process request, database and Stripe metrics for Prometheus
+#
+# Counters, gauges and histograms keep their values in plain dicts keyed by
+# the label values tuple, so recording a sample is one dict update under a
+# lock. ``Registry.render()`` writes the Prometheus text exposition format.
+#
+# Prefork servers (gunicorn) give every worker its own registry. With a
+# multiprocess directory each worker writes a snapshot of its values there at
+# most once per interval, and /metrics serves the sum over all workers. The
+# values of workers that exited are folded into an archive file (gauges are
+# dropped), so counters never go backwards when workers are recycled.
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from lazy_imports import lazy_import
+from usage import try_lock
+
+stripe = lazy_import('stripe')
+
+# Seconds; covers fast cached reads up to slow exports and Stripe calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self):
+        """``[[labels, value], ...]`` with JSON-serializable values"""
+        with self._lock:
+            return [[list(labels), value[:] if isinstance(value, list) else value]
+                    for labels, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Per label set: the count of samples in each bucket (the last one is
+    +Inf) followed by the sum of all samples"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+
+def _merge(total, snapshot, skip_gauges=False, kinds=None):
+    """Add the values of ``snapshot`` ({name: [[labels, value], ...]}) into ``total``"""
+    for name, values in snapshot.items():
+        if skip_gauges and kinds.get(name) == 'gauge':
+            continue
+        merged = total.setdefault(name, {})
+        for labels, value in values:
+            key = tuple(labels)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = value[:] if isinstance(value, list) else value
+            elif isinstance(value, list):
+                if len(value) == len(current):
+                    merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = current + value
+    return total
+
+
+def _label_text(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, documentation, labelnames, buckets))
+
+    def kinds(self):
+        return {name: metric.kind for name, metric in self.metrics.items()}
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def render(self, values=None):
+        """Prometheus text format of ``values`` (merged snapshots; this process's values by default)"""
+        if values is None:
+            values = _merge({}, self.snapshot())
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(values.get(name, {}).items()):
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_label_text(metric.labelnames, labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_label_text(metric.labelnames, labels, ('le', _number(bound)))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_label_text(metric.labelnames, labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_label_text(metric.labelnames, labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class MultiProcessStore:
+    """Shares a registry's values with the other processes using ``directory``"""
+
+    def __init__(self, registry, directory, interval=1.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = None
+        self._last_write = 0.0
+        self._write_lock = threading.Lock()
+        self._claim()
+
+    def _claim(self):
+        """Start a new owner (at creation and in every forked child)"""
+        if self._lock_file is not None:
+            self._lock_file.close()  # the parent's lock, inherited by the fork
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock_file = open(os.path.join(self.directory, f"owner-{self.owner}.lock"), 'a')
+        try_lock(self._lock_file)
+        self._last_write = 0.0
+
+    def _path(self, owner):
+        return os.path.join(self.directory, f"values-{owner}.json")
+
+    def write(self):
+        with self._write_lock:
+            path = self._path(self.owner)
+            with open(path + '.tmp', 'w', encoding='utf-8') as handle:
+                json.dump(self.registry.snapshot(), handle, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+            self._last_write = time.monotonic()
+
+    def maybe_write(self):
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def _archive_dead_owners(self, kinds):
+        """Fold the values of processes that exited into the archive (gauges are dropped)"""
+        with open(os.path.join(self.directory, 'archive.lock'), 'a') as archive_lock:
+            if not try_lock(archive_lock):
+                return  # another process is archiving
+            archive_path = os.path.join(self.directory, 'archive.json')
+            archive = None
+            for name in os.listdir(self.directory):
+                if not name.startswith('owner-') or name == f"owner-{self.owner}.lock":
+                    continue
+                owner = name[len('owner-'):-len('.lock')]
+                lock_path = os.path.join(self.directory, name)
+                with open(lock_path, 'a') as lock_file:
+                    if not try_lock(lock_file):
+                        continue  # owner is still alive
+                    if archive is None:
+                        archive = _merge({}, self._read(archive_path))
+                    _merge(archive, self._read(self._path(owner)), skip_gauges=True, kinds=kinds)
+                    with open(archive_path + '.tmp', 'w', encoding='utf-8') as handle:
+                        json.dump({metric: [[list(labels), value] for labels, value in values.items()]
+                                   for metric, values in archive.items()}, handle, separators=(',', ':'))
+                    os.replace(archive_path + '.tmp', archive_path)
+                    if os.path.exists(self._path(owner)):
+                        os.remove(self._path(owner))
+                os.remove(lock_path)
+
+    def collect(self):
+        """Values summed over every process (this one's are current)"""
+        self.write()
+        kinds = self.registry.kinds()
+        self._archive_dead_owners(kinds)
+        values = _merge({}, self._read(os.path.join(self.directory, 'archive.json')))
+        for name in os.listdir(self.directory):
+            if name.startswith('values-') and name.endswith('.json') and name != f"values-{self.owner}.json":
+                _merge(values, self._read(os.path.join(self.directory, name)))
+        return _merge(values, self.registry.snapshot())
+
+    def close(self):
+        self.write()
+        self._lock_file.close()
+
+
+# ---------------- Application metrics ---------------- #
+registry = Registry()
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by route', ('method', 'route'))
+REQUESTS = registry.counter(
+    'http_requests_total', 'Requests by route and response status', ('method', 'route', 'status'))
+REQUEST_EXCEPTIONS = registry.counter(
+    'http_request_exceptions_total', 'Requests that raised an unhandled exception', ('method', 'route'))
+REQUESTS_IN_PROGRESS = registry.gauge(
+    'http_requests_in_progress', 'Requests being served', ('method', 'route'))
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database queries per request', ('method', 'route'), QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = registry.histogram(
+    'http_request_db_seconds', 'Database time per request', ('method', 'route'))
+DB_QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'Duration of every database statement')
+STRIPE_DURATION = registry.histogram(
+    'stripe_request_duration_seconds', 'Stripe API call latency by operation and outcome',
+    ('operation', 'outcome'))
+
+# [queries, seconds] of the request running in the current thread, if any
+_request_db_usage = ContextVar('request_db_usage', default=None)
+_store = None
+
+
+def instrument_sqlalchemy():
+    """Time every statement of every engine (idempotent)"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    if event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(conn)
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        _record_query(context.connection)
+
+
+def _record_query(conn):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    DB_QUERY_DURATION.observe((), elapsed)
+    usage = _request_db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+
+
+def stripe_call(operation, *args, **kwargs):
+    """Call ``stripe.<operation>`` (e.g. ``'Subscription.modify'``) and record its latency"""
+    resource, method = operation.split('.')
+    func = getattr(getattr(stripe, resource), method)
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        result = func(*args, **kwargs)
+        outcome = 'ok'
+        return result
+    finally:
+        STRIPE_DURATION.observe((operation, outcome), time.perf_counter() - start)
+
+
+def configure(config):
+    """Time database statements and, with METRICS_MULTIPROCESS_DIR, share values
+    with the other workers (idempotent); False when metrics are disabled"""
+    global _store
+    if not config['METRICS_ENABLED']:
+        return False
+    instrument_sqlalchemy()
+    if config['METRICS_MULTIPROCESS_DIR'] and _store is None:
+        _store = MultiProcessStore(registry, config['METRICS_MULTIPROCESS_DIR'], config['METRICS_WRITE_INTERVAL'])
+        os.register_at_fork(after_in_child=_after_fork)
+        atexit.register(_close_store)
+    return True
+
+
+def start_request(labels):
+    """Begin timing a request labelled ``(method, route)``; returns its start time"""
+    _request_db_usage.set([0, 0.0])
+    REQUESTS_IN_PROGRESS.inc(labels)
+    return time.perf_counter()
+
+
+def finish_request(labels, start, status, failed=False):
+    """Record a request begun with ``start_request()``"""
+    REQUEST_DURATION.observe(labels, time.perf_counter() - start)
+    REQUESTS_IN_PROGRESS.dec(labels)
+    REQUESTS.inc(labels + (str(status),))
+    if failed:
+        REQUEST_EXCEPTIONS.inc(labels)
+    queries, seconds = _request_db_usage.get() or (0, 0.0)
+    _request_db_usage.set(None)
+    REQUEST_QUERIES.observe(labels, queries)
+    REQUEST_QUERY_SECONDS.observe(labels, seconds)
+    if _store is not None:
+        _store.maybe_write()
+
+
+def render():
+    """Prometheus text of this process, or of every process sharing the multiprocess directory"""
+    return registry.render(_store.collect() if _store is not None else None)
+
+
+def init_app(app):
+    """Record request metrics for ``app`` and serve them at METRICS_PATH"""
+    from flask import g, request
+
+    if not configure(app.config):
+        return
+    path = app.config['METRICS_PATH']
+
+    @app.before_request
+    def start_request_metrics():
+        if request.path == path:
+            return
+        labels = (request.method, request.url_rule.rule if request.url_rule is not None else 'unmatched')
+        g.metrics = (labels, start_request(labels))
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        state = g.pop('metrics', None)
+        if state is not None:
+            finish_request(*state, g.pop('metrics_status', 500), failed=exc is not None)
+
+    @app.route(path, endpoint='metrics', methods=['GET'])
+    def metrics_endpoint():
+        return app.response_class(render(), content_type=CONTENT_TYPE)
+
+
+def _close_store():
+    if _store is not None:
+        _store.close()
+
+
+def _after_fork():
+    """A forked worker starts from zero instead of repeating the parent's values"""
+    registry.reset()
+    if _store is not None:
+        _store._claim()
@@ -0,0 +1,239 @@
+# models.py - Database models shared by the app, setup script and tools
+#
+# ``db`` is bound to an application by app.create_app() (db.init_app), so the
+# models can be imported without building the Flask app.
+import uuid
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    stripe_customer_id = db.Column(db.String(100), unique=True)
+    phone = db.Column(db.String(20))
+    company = db.Column(db.String(100))
+    status = db.Column(db.String(20), default='active')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_login = db.Column(db.DateTime)
+    subscriptions = db.relationship('Subscription', backref='user', lazy=True)
+
+class Plan(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    interval = db.Column(db.String(20), default='monthly')
+    stripe_price_id = db.Column(db.String(100), unique=True)
+    stripe_product_id = db.Column(db.String(100))
+    features = db.Column(db.JSON)
+    active = db.Column(db.Boolean, default=True)
+    trial_days = db.Column(db.Integer, default=0)
+    setup_fee = db.Column(db.Numeric(10, 2), default=0)
+    # Metric billed through this plan's metered Stripe price, if any
+    usage_metric = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    subscriptions = db.relationship('Subscription', backref='plan', lazy=True)
+
+class PlanLimit(db.Model):
+    """Usage allowed per billing period for one metric of a plan (NULL = unlimited)"""
+    plan_id = db.Column(db.Integer, db.ForeignKey('plan.id'), primary_key=True)
+    metric_name = db.Column(db.String(100), primary_key=True)
+    limit_value = db.Column(db.Float)
+
+class Subscription(db.Model):
+    # Delta exports scan updated_at ranges in (updated_at, id) order
+    __table_args__ = (db.Index('ix_subscription_updated_at_id', 'updated_at', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey('plan.id'), nullable=False)
+    stripe_subscription_id = db.Column(db.String(100), unique=True)
+    stripe_subscription_item_id = db.Column(db.String(100))
+    status = db.Column(db.String(50), default='active')
+    current_period_start = db.Column(db.DateTime)
+    current_period_end = db.Column(db.DateTime)
+    cancel_at_period_end = db.Column(db.Boolean, default=False)
+    quantity = db.Column(db.Integer, default=1)
+    trial_end = db.Column(db.DateTime)
+    canceled_at = db.Column(db.DateTime)
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupon.id'))
+    mrr = db.Column(db.Numeric(12, 4), nullable=False, default=0)
+    # Keep one usage row per event instead of pre-aggregated buckets
+    raw_usage = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SubscriptionTombstone(db.Model):
+    """A deleted subscription, kept so delta exports can report the deletion"""
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Tombstones are written by a database trigger, so bulk ``query.delete()``,
+# Core DELETEs and deletes from outside the app are recorded too. deleted_at
+# is UTC, like the utcnow() timestamps written by the app.
+SUBSCRIPTION_TOMBSTONE_TRIGGER = {
+    'sqlite': (
+        "CREATE TRIGGER subscription_tombstone_after_delete AFTER DELETE ON subscription "
+        "BEGIN INSERT INTO subscription_tombstone (subscription_id, deleted_at) "
+        "VALUES (OLD.id, strftime('%Y-%m-%d %H:%M:%f000', 'now')); END",
+    ),
+    'mysql': (
+        "CREATE TRIGGER subscription_tombstone_after_delete AFTER DELETE ON subscription FOR EACH ROW "
+        "INSERT INTO subscription_tombstone (subscription_id, deleted_at) VALUES (OLD.id, UTC_TIMESTAMP(6))",
+    ),
+    'postgresql': (
+        "CREATE OR REPLACE FUNCTION record_subscription_tombstone() RETURNS trigger AS $$ BEGIN "
+        "INSERT INTO subscription_tombstone (subscription_id, deleted_at) "
+        "VALUES (OLD.id, clock_timestamp() AT TIME ZONE 'UTC'); RETURN OLD; END $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER subscription_tombstone_after_delete AFTER DELETE ON subscription FOR EACH ROW "
+        "EXECUTE FUNCTION record_subscription_tombstone()",
+    ),
+}
+
+# Created (and restored) before subscription, so clearing tables in reverse
+# order also clears the tombstones the trigger wrote
+Subscription.__table__.add_is_dependent_on(SubscriptionTombstone.__table__)
+
+@db.event.listens_for(Subscription.__table__, 'after_create')
+def create_subscription_tombstone_trigger(target, connection, **kw):
+    for statement in SUBSCRIPTION_TOMBSTONE_TRIGGER.get(connection.dialect.name, ()):
+        connection.exec_driver_sql(statement)
+
+class SubscriptionCounter(db.Model):
+    """Running subscription count and MRR per (status, plan), maintained in the
+    same transaction as every subscription status/plan/quantity change"""
+    status = db.Column(db.String(50), primary_key=True)
+    plan_id = db.Column(db.Integer, db.ForeignKey('plan.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mrr = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+
+class Coupon(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    discount_type = db.Column(db.String(20), nullable=False)
+    discount_value = db.Column(db.Numeric(10, 2), nullable=False)
+    stripe_coupon_id = db.Column(db.String(100))
+    valid_from = db.Column(db.DateTime, default=datetime.utcnow)
+    valid_until = db.Column(db.DateTime)
+    max_uses = db.Column(db.Integer)
+    current_uses = db.Column(db.Integer, default=0)
+    active = db.Column(db.Boolean, default=True)
+
+class AuditLog(db.Model):
+    __table_args__ = (db.Index('ix_audit_log_action_timestamp', 'action', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    action = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    extra_data = db.Column(db.JSON)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    ip_address = db.Column(db.String(45))
+
+class UsageLog(db.Model):
+    __table_args__ = (db.Index('ix_usage_log_subscription_metric_timestamp', 'subscription_id', 'metric_name', 'timestamp'),)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=False)
+    metric_name = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    # Number of events summed into this row (1 for raw events; for aggregated
+    # rows the timestamp is the start of the bucket)
+    event_count = db.Column(db.Integer, nullable=False, default=1)
+    extra_data = db.Column(db.JSON)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class UsageIdempotencyKey(db.Model):
+    """Idempotency keys of accepted usage events, kept for USAGE_IDEMPOTENCY_WINDOW"""
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), primary_key=True)
+    idempotency_key = db.Column(db.String(255), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Random token of the INSERT that stored the key; tells MySQL's INSERT IGNORE
+    # which keys of a batch were new
+    batch_token = db.Column(db.String(32))
+
+class UsagePush(db.Model):
+    """Last usage total sent to Stripe for a subscription's billing period"""
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), primary_key=True)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    metric_name = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.BigInteger, nullable=False)
+    pushed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UsageRollupHourly(db.Model):
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), primary_key=True)
+    metric_name = db.Column(db.String(100), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+
+class UsageRollupDaily(db.Model):
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), primary_key=True)
+    metric_name = db.Column(db.String(100), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+
+class JobCheckpoint(db.Model):
+    """Resume position of a background job (JSON-encoded value)"""
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.JSON)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ExportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    entity = db.Column(db.String(50), nullable=False)
+    format = db.Column(db.String(20), nullable=False)
+    compression = db.Column(db.String(20))
+    columns = db.Column(db.JSON)
+    filters = db.Column(db.JSON)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    rows_total = db.Column(db.Integer)
+    rows_written = db.Column(db.Integer, nullable=False, default=0)
+    bytes_written = db.Column(db.BigInteger, nullable=False, default=0)
+    file_name = db.Column(db.String(255))
+    content_type = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # New on every claim; only the attempt holding it may update the job, and it names the file
+    claim_token = db.Column(db.String(32))
+
+class BulkOperation(db.Model):
+    """A change applied to every subscription matching ``filters``, in id order"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    operation = db.Column(db.String(50), nullable=False)
+    filters = db.Column(db.JSON, nullable=False)
+    params = db.Column(db.JSON, nullable=False)
+    # queued -> running -> completed | failed; paused and canceled are set through the API
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    rows_total = db.Column(db.Integer)
+    # Checkpoint: every matching subscription with id <= last_id has been processed
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    succeeded = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class DailyMetric(db.Model):
+    """One row per day: subscription events counted from the audit log plus an
+    end-of-day snapshot of the counters (written by the rollup job)"""
+    day = db.Column(db.Date, primary_key=True)
+    new_subscriptions = db.Column(db.Integer, nullable=False, default=0)
+    cancellations = db.Column(db.Integer, nullable=False, default=0)
+    reactivations = db.Column(db.Integer, nullable=False, default=0)
+    plan_changes = db.Column(db.Integer, nullable=False, default=0)
+    active_subscriptions = db.Column(db.Integer)
+    mrr = db.Column(db.Numeric(14, 2))
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
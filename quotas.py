@@ -0,0 +1,177 @@
+# quotas.py - Plan usage limits and in-memory quota counters
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_FEATURE = re.compile(
+    r'^\s*(?:(?P<unlimited>unlimited)|(?P<value>\d[\d,]*(?:\.\d+)?)\s*(?:(?P<unit>[kmgt]b)|(?P<scale>[km]))?)'
+    r'\s+(?P<name>.+?)\s*$',
+    re.IGNORECASE
+)
+_SCALES = {'k': 1000, 'm': 1000000}
+
+
+def metric_slug(text):
+    """'API Calls' -> 'api_calls'"""
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def parse_feature(feature):
+    """Read a limit out of a plan feature string.
+
+    ``'5 Projects'`` -> ``('projects', 5.0)``, ``'10GB Storage'`` ->
+    ``('storage_gb', 10.0)``, ``'1M API calls'`` -> ``('api_calls', 1000000.0)``
+    and ``'Unlimited Projects'`` -> ``('projects', None)``. Returns None for
+    features that are not limits, such as ``'Priority Support'``.
+    """
+    match = _FEATURE.match(feature) if isinstance(feature, str) else None
+    if not match:
+        return None
+    metric = metric_slug(match.group('name'))
+    if not metric:
+        return None
+    if match.group('unlimited'):
+        return metric, None
+    value = float(match.group('value').replace(',', ''))
+    if match.group('unit'):
+        metric = f"{metric}_{match.group('unit').lower()}"
+    if match.group('scale'):
+        value *= _SCALES[match.group('scale').lower()]
+    return metric, value
+
+
+def limits_from_features(features):
+    """``{metric: limit}`` for every feature string that describes a limit (None = unlimited)"""
+    limits = {}
+    for feature in features or ():
+        parsed = parse_feature(feature)
+        if parsed:
+            limits[parsed[0]] = parsed[1]
+    return limits
+
+
+class QuotaCache:
+    """Answers quota checks from memory.
+
+    Subscriptions, plan limits and per-period usage totals are loaded through
+    the given callbacks on first use and kept for ``ttl`` seconds, at most
+    ``max_entries`` of each (least recently used ones are evicted). Usage
+    ingested by this process is added to the cached totals as it arrives;
+    usage ingested by other processes shows up when the totals are reloaded,
+    so ``ttl`` bounds how stale a check can be.
+
+    ``load_subscription(id)`` returns ``{'plan_id', 'status', 'period_start',
+    'period_end'}`` or None, ``load_limits(plan_id)`` returns ``{metric:
+    limit}`` and ``load_usage(id, start, end)`` returns ``{metric: total}``.
+    """
+
+    def __init__(self, load_subscription, load_limits, load_usage, ttl=30, max_entries=100000,
+                 clock=time.monotonic):
+        self.load_subscription = load_subscription
+        self.load_limits = load_limits
+        self.load_usage = load_usage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._subscriptions = OrderedDict()
+        self._limits = OrderedDict()
+        self._usage = OrderedDict()
+        self._marker = 0
+        self._lock = threading.Lock()
+
+    def mark(self):
+        """A marker ordering loads and commits; take it right after committing usage and pass it to ``record()``"""
+        with self._lock:
+            self._marker += 1
+            return self._marker
+
+    def _cached(self, cache, key, load, now):
+        """Entries are ``[expires, value, marker taken before the load]``"""
+        with self._lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] > now:
+                cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        loaded = self.mark()
+        value = load()
+        with self._lock:
+            cache[key] = [now + self.ttl, value, loaded]
+            cache.move_to_end(key)
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return value
+
+    def check(self, subscription_id, metric_name, quantity=0):
+        """Quota state of one metric, or None when the subscription does not exist"""
+        now = self.clock()
+        subscription = self._cached(self._subscriptions, subscription_id,
+                                    lambda: self.load_subscription(subscription_id), now)
+        if subscription is None:
+            with self._lock:
+                self._subscriptions.pop(subscription_id, None)  # do not cache misses
+            return None
+        limits = self._cached(self._limits, subscription['plan_id'],
+                              lambda: self.load_limits(subscription['plan_id']), now)
+        start, end = subscription['period_start'], subscription['period_end']
+        totals = self._cached(self._usage, (subscription_id, start),
+                              lambda: self.load_usage(subscription_id, start, end), now)
+
+        limit = limits.get(metric_name)
+        used = totals.get(metric_name, 0.0)
+        return {
+            'subscription_id': subscription_id,
+            'metric_name': metric_name,
+            'status': subscription['status'],
+            'limit': limit,
+            'used': used,
+            'remaining': None if limit is None else max(limit - used, 0.0),
+            'over_quota': limit is not None and used > limit,
+            'allowed': limit is None or used + quantity <= limit,
+            'period_start': start,
+            'period_end': end,
+        }
+
+    def record(self, rows, committed=None):
+        """Add ingested usage rows to the cached totals they belong to.
+
+        ``committed`` is the ``mark()`` taken after the rows were committed;
+        totals loaded after that already include them and are left alone.
+        Without it (rows not in the database yet) they are always added.
+        """
+        with self._lock:
+            for row in rows:
+                entry = self._subscriptions.get(row['subscription_id'])
+                if entry is None or entry[1] is None:
+                    continue
+                subscription = entry[1]
+                if not subscription['period_start'] <= row['timestamp'] < subscription['period_end']:
+                    continue
+                usage = self._usage.get((row['subscription_id'], subscription['period_start']))
+                if usage is not None and (committed is None or usage[2] < committed):
+                    totals = usage[1]
+                    totals[row['metric_name']] = totals.get(row['metric_name'], 0.0) + row['quantity']
+
+    def invalidate_subscription(self, subscription_id):
+        with self._lock:
+            self._subscriptions.pop(subscription_id, None)
+            for key in [key for key in self._usage if key[0] == subscription_id]:
+                self._usage.pop(key, None)
+
+    def invalidate_plan(self, plan_id):
+        with self._lock:
+            self._limits.pop(plan_id, None)
+
+    def status(self):
+        return {
+            'ttl': self.ttl,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'subscriptions': len(self._subscriptions),
+            'usage_periods': len(self._usage),
+        }
@@ -0,0 +1,305 @@
+# segment_store.py - Append-only memory-mapped segment files for raw usage events
+#
+# Every event is a fixed-width 32 byte record (RECORD), so a segment file can be
+# memory mapped and read as one NumPy array without parsing. Metric names are
+# interned into a shared append-only dictionary and stored as integer ids.
+#
+# Each process appends to its own active segment, which is sealed once it is
+# older than ``rotate_seconds`` or larger than ``max_segment_bytes``. Compaction
+# merges sealed segments into one file per event day, sorted by
+# (subscription_id, timestamp), next to an index of each subscription's offset
+# and record count, so replaying one subscription's period only reads its slice.
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from usage import fcntl, try_lock
+
+RECORD = np.dtype([
+    ('timestamp', '<i8'),        # microseconds since the Unix epoch (UTC)
+    ('subscription_id', '<i8'),
+    ('metric', '<u4'),           # id in the metric dictionary
+    ('reserved', '<u4'),
+    ('quantity', '<f8'),
+])
+INDEX = np.dtype([('subscription_id', '<i8'), ('offset', '<i8'), ('count', '<i8')])
+
+EPOCH = datetime(1970, 1, 1)
+MICROS_PER_DAY = 86400 * 1000000
+
+
+def to_micros(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def load_segment(path):
+    """Memory map a segment as a RECORD array (a torn final record is ignored)"""
+    try:
+        count = os.path.getsize(path) // RECORD.itemsize
+    except FileNotFoundError:
+        return np.empty(0, dtype=RECORD)
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', shape=(count,))
+
+
+class MetricDictionary:
+    """Append-only metric name <-> id mapping shared by all processes.
+
+    One JSON-encoded name per line; a name's id is its line number. New names
+    are appended under an exclusive file lock after re-reading the file, so
+    concurrent writers never hand out the same id twice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = {}
+        self._names = []
+        self._lock = threading.Lock()
+        open(path, 'a').close()
+
+    def _reload(self):
+        with open(self.path, encoding='utf-8') as handle:
+            content = handle.read()
+        # A line without its newline is a torn write and not handed out yet
+        self._names = [json.loads(line) for line in content.split('\n')[:-1]]
+        self._ids = {name: index for index, name in enumerate(self._names)}
+        return content
+
+    def intern(self, name):
+        metric_id = self._ids.get(name)
+        if metric_id is not None:
+            return metric_id
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                content = self._reload()
+                if name not in self._ids:
+                    if content and not content.endswith('\n'):
+                        handle.write('\n')  # seal the torn line so ids stay aligned
+                        self._names.append(None)
+                    handle.write(json.dumps(name) + '\n')
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                    self._ids[name] = len(self._names)
+                    self._names.append(name)
+                return self._ids[name]
+
+    def name(self, metric_id):
+        if metric_id >= len(self._names):
+            with self._lock:
+                self._reload()
+        return self._names[metric_id]
+
+
+class SegmentStore:
+    """Raw usage events in append-only segment files under ``directory``"""
+
+    def __init__(self, directory, rotate_seconds=3600, max_segment_bytes=64 * 1024 * 1024, fsync=False):
+        self.directory = directory
+        self.rotate_seconds = rotate_seconds
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        self.pid = os.getpid()
+        self.owner = f"{self.pid}-{uuid.uuid4().hex[:8]}"
+        self.events_written = 0
+        self.last_compaction = None
+        self._active = None
+        self._opened_at = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.metrics = MetricDictionary(os.path.join(directory, 'metrics.dict'))
+        self._owner_lock = open(self._path(f"owner-{self.owner}.lock"), 'w')
+        try_lock(self._owner_lock)
+        self._active_path = self._path(f"active-{self.owner}.seg")
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _files(self, prefix, suffix='.seg'):
+        return sorted(self._path(name) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and name.endswith(suffix))
+
+    @contextlib.contextmanager
+    def _compaction_lock(self, shared):
+        """Readers share this lock; compaction holds it exclusively while swapping files"""
+        with open(self._path('compact.lock'), 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def append(self, rows):
+        """Append validated usage rows to this process's active segment"""
+        if not rows:
+            return
+        records = np.zeros(len(rows), dtype=RECORD)
+        records['timestamp'] = [to_micros(row['timestamp']) for row in rows]
+        records['subscription_id'] = [row['subscription_id'] for row in rows]
+        records['metric'] = [self.metrics.intern(row['metric_name']) for row in rows]
+        records['quantity'] = [row['quantity'] for row in rows]
+        data = records.tobytes()
+        with self._lock:
+            if self._active is None:
+                self._active = open(self._active_path, 'ab')
+                self._opened_at = time.time()
+            self._active.write(data)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self.events_written += len(rows)
+            if self._should_rotate():
+                self._seal()
+
+    def _should_rotate(self):
+        return (self._active is not None and
+                (time.time() - self._opened_at >= self.rotate_seconds or
+                 self._active.tell() >= self.max_segment_bytes))
+
+    def _seal(self):
+        self._active.close()
+        self._active = None
+        self._sequence += 1
+        os.replace(self._active_path, self._path(f"sealed-{self.owner}-{self._sequence:06d}.seg"))
+
+    def rotate(self):
+        """Seal the active segment if it is due, even when no events arrive"""
+        with self._lock:
+            if self._should_rotate():
+                self._seal()
+
+    def _seal_orphans(self):
+        """Seal active segments of processes that no longer hold their owner lock"""
+        for lock_path in self._files('owner-', '.lock'):
+            owner = os.path.basename(lock_path)[len('owner-'):-len('.lock')]
+            if owner == self.owner:
+                continue
+            with open(lock_path, 'a') as handle:
+                if not try_lock(handle):
+                    continue
+                active = self._path(f"active-{owner}.seg")
+                if os.path.exists(active):
+                    os.replace(active, self._path(f"sealed-{owner}-orphan.seg"))
+            os.remove(lock_path)
+
+    def _finish_compaction(self):
+        """Redo a compaction whose manifest was written but not completed"""
+        manifest_path = self._path('compaction.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as handle:
+                manifest = json.load(handle)
+            for source, target in manifest['outputs']:
+                if os.path.exists(source):
+                    os.replace(source, target)
+            for path in manifest['inputs']:
+                if os.path.exists(path):
+                    os.remove(path)
+            os.remove(manifest_path)
+        for path in self._files('', '.tmp'):
+            os.remove(path)  # outputs of a compaction that crashed before its manifest
+
+    def compact(self):
+        """Merge sealed segments into per-day sorted segments; returns records merged"""
+        self.rotate()
+        with self._compaction_lock(shared=False):
+            self._finish_compaction()
+            self._seal_orphans()
+            sealed = self._files('sealed-')
+            if not sealed:
+                self.last_compaction = time.time()
+                return 0
+
+            records = np.concatenate([load_segment(path) for path in sealed])
+            days = records['timestamp'] // MICROS_PER_DAY
+            outputs = []
+            for day in np.unique(days).tolist():
+                name = f"day-{from_micros(day * MICROS_PER_DAY):%Y-%m-%d}"
+                merged = np.concatenate([load_segment(self._path(name + '.seg')), records[days == day]])
+                merged = merged[np.lexsort((merged['timestamp'], merged['subscription_id']))]
+                subscriptions, offsets = np.unique(merged['subscription_id'], return_index=True)
+                index = np.empty(len(subscriptions), dtype=INDEX)
+                index['subscription_id'] = subscriptions
+                index['offset'] = offsets
+                index['count'] = np.diff(np.append(offsets, len(merged)))
+                for suffix, array in (('.seg', merged), ('.idx', index)):
+                    temporary = self._path(name + suffix + '.tmp')
+                    with open(temporary, 'wb') as handle:
+                        handle.write(array.tobytes())
+                        handle.flush()
+                        os.fsync(handle.fileno())
+                    outputs.append((temporary, self._path(name + suffix)))
+
+            # The manifest is the commit point: once it exists the swap is redone after a crash
+            with open(self._path('compaction.json.tmp'), 'w', encoding='utf-8') as handle:
+                json.dump({'inputs': sealed, 'outputs': outputs}, handle)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(self._path('compaction.json.tmp'), self._path('compaction.json'))
+            self._finish_compaction()
+            self.last_compaction = time.time()
+            return len(records)
+
+    def replay(self, subscription_id, start, end):
+        """Events of one subscription with ``start <= timestamp < end``, in time order.
+
+        Yields ``{'timestamp', 'metric_name', 'quantity'}`` dicts.
+        """
+        start_us, end_us = to_micros(start), to_micros(end)
+        parts = []
+        with self._compaction_lock(shared=True):
+            first_day, last_day = f"day-{start:%Y-%m-%d}.seg", f"day-{end:%Y-%m-%d}.seg"
+            for path in self._files('day-'):
+                if not first_day <= os.path.basename(path) <= last_day:
+                    continue
+                index = np.fromfile(path[:-len('.seg')] + '.idx', dtype=INDEX)
+                position = np.searchsorted(index['subscription_id'], subscription_id)
+                if position == len(index) or index['subscription_id'][position] != subscription_id:
+                    continue
+                offset, count = int(index['offset'][position]), int(index['count'][position])
+                parts.append(load_segment(path)[offset:offset + count])
+            # Not yet compacted: scan whole segments, they are bounded by rotation
+            for path in self._files('sealed-') + self._files('active-'):
+                records = load_segment(path)
+                parts.append(records[records['subscription_id'] == subscription_id])
+
+            records = np.concatenate(parts) if parts else np.empty(0, dtype=RECORD)
+            records = records[(records['timestamp'] >= start_us) & (records['timestamp'] < end_us)]
+            records = records[np.argsort(records['timestamp'], kind='stable')]
+
+        for timestamp, metric, quantity in zip(records['timestamp'].tolist(), records['metric'].tolist(),
+                                               records['quantity'].tolist()):
+            yield {'timestamp': from_micros(timestamp), 'metric_name': self.metrics.name(metric),
+                   'quantity': quantity}
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._seal()
+        self._owner_lock.close()
+        os.remove(self._owner_lock.name)
+
+    def status(self):
+        def size(paths):
+            return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        sealed, days = self._files('sealed-'), self._files('day-')
+        return {
+            'owner': self.owner,
+            'events_written': self.events_written,
+            'sealed_segments': len(sealed),
+            'sealed_bytes': size(sealed),
+            'day_segments': len(days),
+            'day_bytes': size(days),
+            'last_compaction': self.last_compaction,
+        }
@@ -0,0 +1,196 @@
+# serializers.py - Precompiled response serializers for API models
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+
+def iso(value):
+    """Render a date/datetime column as ISO-8601 (None stays None)"""
+    return value.isoformat() if value is not None else None
+
+
+def number(value):
+    """Render a Numeric column as a JSON number (None stays None)"""
+    return float(value) if value is not None else None
+
+
+class ModelSerializer:
+    """Turns model instances into plain dicts.
+
+    Fields are declared once as ``name -> converter`` (``None`` means the
+    attribute is copied as-is). For every field subset a dedicated function is
+    generated and cached, so serializing a row is a single dict literal with no
+    per-field branching or ``getattr`` loop.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = dict(fields)
+        for field in self.fields:
+            if not field.isidentifier():
+                raise ValueError(f"Invalid field name for {name}: {field!r}")
+        self._compiled = {}
+
+    def compile(self, fields=None):
+        """Return the (cached) row function for ``fields`` (all fields by default)"""
+        key = tuple(fields) if fields is not None else tuple(self.fields)
+        func = self._compiled.get(key)
+        if func is not None:
+            return func
+
+        unknown = [field for field in key if field not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown {self.name} fields: {', '.join(unknown)}")
+
+        namespace = {}
+        items = []
+        for index, field in enumerate(key):
+            converter = self.fields[field]
+            if converter is None:
+                items.append(f"{field!r}: obj.{field}")
+            else:
+                namespace[f"_c{index}"] = converter
+                items.append(f"{field!r}: _c{index}(obj.{field})")
+        source = f"def serialize(obj):\n    return {{{', '.join(items)}}}\n"
+        exec(compile(source, f"<serializer {self.name}>", "exec"), namespace)
+        func = namespace['serialize']
+        self._compiled[key] = func
+        return func
+
+    def dump(self, obj, fields=None):
+        return self.compile(fields)(obj)
+
+    def dump_many(self, objs, fields=None):
+        func = self.compile(fields)
+        return [func(obj) for obj in objs]
+
+    def parse_fields(self, raw):
+        """Parse a ``fields=a,b,c`` query parameter into a validated tuple"""
+        if not raw:
+            return None
+        fields = tuple(field.strip() for field in raw.split(',') if field.strip())
+        self.compile(fields)
+        return fields
+
+
+USER = ModelSerializer('User', {
+    'id': None,
+    'email': None,
+    'name': None,
+    'phone': None,
+    'company': None,
+    'status': None,
+    'created_at': iso,
+    'last_login': iso,
+    'stripe_customer_id': None,
+})
+
+PLAN = ModelSerializer('Plan', {
+    'id': None,
+    'name': None,
+    'description': None,
+    'amount': number,
+    'interval': None,
+    'features': None,
+    'active': None,
+    'trial_days': None,
+    'setup_fee': number,
+    'usage_metric': None,
+    'stripe_price_id': None,
+    'stripe_product_id': None,
+    'created_at': iso,
+})
+
+SUBSCRIPTION = ModelSerializer('Subscription', {
+    'id': None,
+    'user_id': None,
+    'plan_id': None,
+    'stripe_subscription_id': None,
+    'status': None,
+    'quantity': None,
+    'current_period_start': iso,
+    'current_period_end': iso,
+    'cancel_at_period_end': None,
+    'trial_end': iso,
+    'canceled_at': iso,
+    'coupon_id': None,
+    'mrr': number,
+    'raw_usage': None,
+    'created_at': iso,
+    'updated_at': iso,
+})
+
+COUPON = ModelSerializer('Coupon', {
+    'id': None,
+    'code': None,
+    'discount_type': None,
+    'discount_value': number,
+    'stripe_coupon_id': None,
+    'valid_from': iso,
+    'valid_until': iso,
+    'max_uses': None,
+    'current_uses': None,
+    'active': None,
+})
+
+AUDIT_LOG = ModelSerializer('AuditLog', {
+    'id': None,
+    'user_id': None,
+    'action': None,
+    'description': None,
+    'extra_data': None,
+    'timestamp': iso,
+    'ip_address': None,
+})
+
+# Field subsets used by the existing endpoints, kept identical to their
+# historical response shapes
+USER_SUMMARY_FIELDS = ('id', 'email', 'name', 'stripe_customer_id')
+USER_CREATED_FIELDS = ('id', 'email', 'name', 'phone', 'company', 'stripe_customer_id')
+USER_DETAIL_FIELDS = ('id', 'email', 'name', 'company', 'phone', 'status',
+                      'created_at', 'last_login', 'stripe_customer_id')
+PLAN_FIELDS = ('id', 'name', 'description', 'amount', 'interval', 'features',
+               'trial_days', 'setup_fee', 'usage_metric', 'stripe_price_id')
+PLAN_CREATED_FIELDS = PLAN_FIELDS + ('stripe_product_id',)
+PLAN_SUMMARY_FIELDS = ('id', 'name', 'amount')
+COUPON_CREATED_FIELDS = ('id', 'code', 'discount_type', 'discount_value', 'stripe_coupon_id')
+COUPON_VALIDATION_FIELDS = ('discount_type', 'discount_value', 'stripe_coupon_id')
+USER_SUBSCRIPTION_FIELDS = ('id', 'status', 'quantity', 'current_period_start',
+                            'current_period_end', 'cancel_at_period_end', 'trial_end',
+                            'stripe_subscription_id', 'created_at')
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(payload):
+        """Encode ``payload`` to JSON bytes"""
+        return orjson.dumps(payload, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(payload):
+        """Encode ``payload`` to JSON bytes"""
+        return _encoder.encode(payload).encode('utf-8')
+
+    def loads(data):
+        return json.loads(data)
+
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
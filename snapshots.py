@@ -0,0 +1,203 @@
+# snapshots.py - Point-in-time database snapshots and bulk restore
+#
+# A snapshot is a directory with one subdirectory per table, holding the
+# table's rows in compressed chunk files of at most ``chunk_rows`` rows each,
+# and a manifest.json written last. Every row is one line holding a JSON array
+# in the manifest's column order; Decimals are written as strings so they
+# round-trip exactly. Snapshots are written to a temporary directory and
+# renamed when complete, so a directory with a manifest is always whole.
+import gzip
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import serializers
+
+try:
+    import zstandard
+except ImportError:  # zstd snapshots are optional
+    zstandard = None
+
+FORMAT_VERSION = 1
+# compression -> chunk file suffix
+SUFFIXES = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+
+
+def available_compressions():
+    return ['gzip'] + (['zstd'] if zstandard is not None else [])
+
+
+def _open_chunk(path, compression, mode):
+    if compression == 'gzip':
+        # Level 6 is within a few percent of 9's size at a fraction of the time
+        return gzip.open(path, mode, compresslevel=6) if mode == 'wb' else gzip.open(path, mode)
+    if zstandard is None:
+        raise RuntimeError('zstd snapshots require zstandard')
+    handle = open(path, mode)
+    if mode == 'wb':
+        return zstandard.ZstdCompressor(level=3).stream_writer(handle, closefd=True)
+    return zstandard.ZstdDecompressor().stream_reader(handle, closefd=True)
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _encoders(columns):
+    """Per-column value encoders (None = written as-is)"""
+    return [str if _python_type(column) is Decimal else None for column in columns]
+
+
+def _decoders(columns):
+    decoders = []
+    for column in columns:
+        python_type = _python_type(column)
+        if python_type is datetime:
+            decoders.append(datetime.fromisoformat)
+        elif python_type is date:
+            decoders.append(date.fromisoformat)
+        elif python_type is Decimal:
+            decoders.append(Decimal)
+        else:
+            decoders.append(None)
+    return decoders
+
+
+def _convert(rows, converters):
+    active = [(index, convert) for index, convert in enumerate(converters) if convert is not None]
+    if not active:
+        return [list(row) for row in rows]
+    converted = []
+    for row in rows:
+        row = list(row)
+        for index, convert in active:
+            if row[index] is not None:
+                row[index] = convert(row[index])
+        converted.append(row)
+    return converted
+
+
+def write_snapshot(connection, tables, directory, chunk_rows=100000, compression='gzip', log=print):
+    """Write ``tables`` as read through ``connection`` into the snapshot ``directory``.
+
+    The caller is responsible for ``connection`` seeing one consistent
+    snapshot of the database (a single repeatable-read transaction). Returns
+    the manifest.
+    """
+    if compression not in available_compressions():
+        raise ValueError(f"compression must be one of: {', '.join(available_compressions())}")
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    manifest = {'version': FORMAT_VERSION, 'created_at': datetime.utcnow().isoformat(),
+                'dialect': connection.dialect.name, 'compression': compression, 'tables': []}
+    started = time.monotonic()
+
+    for table in tables:
+        table_started = time.monotonic()
+        columns = list(table.columns)
+        encoders = _encoders(columns)
+        os.makedirs(os.path.join(temporary, table.name))
+        entry = {'name': table.name, 'columns': [column.name for column in columns], 'rows': 0, 'bytes': 0,
+                 'chunks': []}
+        result = connection.execution_options(yield_per=chunk_rows).execute(
+            table.select().order_by(*table.primary_key.columns))
+        for number, rows in enumerate(result.partitions()):
+            name = f"{number:05d}{SUFFIXES[compression]}"
+            path = os.path.join(temporary, table.name, name)
+            with _open_chunk(path, compression, 'wb') as handle:
+                handle.write(b'\n'.join(serializers.dumps(row) for row in _convert(rows, encoders)) + b'\n')
+            entry['chunks'].append({'file': f"{table.name}/{name}", 'rows': len(rows)})
+            entry['rows'] += len(rows)
+            entry['bytes'] += os.path.getsize(path)
+        entry['seconds'] = round(time.monotonic() - table_started, 3)
+        manifest['tables'].append(entry)
+        log(_throughput(f"[SNAPSHOT] {table.name}", entry['rows'], entry['bytes'], entry['seconds']))
+
+    manifest['seconds'] = round(time.monotonic() - started, 3)
+    with open(os.path.join(temporary, 'manifest.json'), 'w', encoding='utf-8') as handle:
+        json.dump(manifest, handle, indent=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as handle:
+        manifest = json.load(handle)
+    if manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+    return manifest
+
+
+def read_chunk(directory, chunk, compression):
+    """Rows of one chunk file as lists of raw JSON values"""
+    with _open_chunk(os.path.join(directory, chunk['file']), compression, 'rb') as handle:
+        data = handle.read()
+    return [serializers.loads(line) for line in data.split(b'\n') if line]
+
+
+def restore_snapshot(connection, tables, directory, log=print):
+    """Bulk load the snapshot ``directory`` into the (empty) ``tables``.
+
+    Secondary indexes are dropped before a table is loaded and rebuilt after
+    it, so rows go in without per-row index maintenance. Tables are loaded in
+    the given order, which must respect foreign keys. Returns ``{table:
+    rows}``.
+    """
+    manifest = read_manifest(directory)
+    entries = {entry['name']: entry for entry in manifest['tables']}
+    restored = {}
+    started = time.monotonic()
+    for table in tables:
+        entry = entries.get(table.name)
+        if entry is None:
+            log(f"[RESTORE] {table.name}: not in snapshot, skipped")
+            continue
+        unknown = [name for name in entry['columns'] if name not in table.c]
+        if unknown:
+            raise ValueError(f"{table.name}: snapshot columns not in the schema: {', '.join(unknown)}")
+
+        table_started = time.monotonic()
+        columns = [table.c[name] for name in entry['columns']]
+        decoders = _decoders(columns)
+        indexes = list(table.indexes)
+        for index in indexes:
+            index.drop(connection)
+        for chunk in entry['chunks']:
+            rows = _convert(read_chunk(directory, chunk, manifest['compression']), decoders)
+            if rows:
+                connection.execute(table.insert(), [dict(zip(entry['columns'], row)) for row in rows])
+        for index in indexes:
+            index.create(connection)
+        _reset_sequence(connection, table)
+        restored[table.name] = entry['rows']
+        log(_throughput(f"[RESTORE] {table.name}", entry['rows'], entry['bytes'],
+                        time.monotonic() - table_started))
+
+    total_rows = sum(restored.values())
+    total_bytes = sum(entries[name]['bytes'] for name in restored)
+    log(_throughput("[RESTORE] total", total_rows, total_bytes, time.monotonic() - started))
+    return restored
+
+
+def _reset_sequence(connection, table):
+    """Move a PostgreSQL serial past the restored ids (other databases track this themselves)"""
+    key = table.autoincrement_column
+    if connection.dialect.name != 'postgresql' or key is None:
+        return
+    connection.exec_driver_sql(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key.name}'), "
+        f"COALESCE((SELECT MAX({key.name}) FROM {table.name}), 0) + 1, false)")
+
+
+def _throughput(label, rows, size, seconds):
+    seconds = max(seconds, 1e-6)
+    return (f"{label}: {rows} rows, {size / 1048576:.1f} MB compressed in {seconds:.2f}s "
+            f"({rows / seconds:,.0f} rows/s, {size / 1048576 / seconds:.1f} MB/s)")
@@ -1,8 +1,11 @@
 # start.py - Easy startup script for subscription management system
 
 import os
+import shutil
+import signal
 import sys
 import subprocess
+import tempfile
 import time
 import webbrowser
 from threading import Timer
@@ -54,6 +57,53 @@ def start_application():
         print(f"[ERROR] Failed to start application: {e}")
         return False
 
+def serve_production():
+    """Run the application under gunicorn with the settings in gunicorn.conf.py"""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("[ERROR] gunicorn is not installed (pip install gunicorn; Linux/macOS only)")
+        return False
+    print("[START] Starting production server (gunicorn.conf.py)...")
+    print("[INFO] Run background jobs separately: flask --app app run-jobs")
+    # Replace this process so signals (Ctrl+C, TERM, HUP) reach the gunicorn master directly
+    os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'])
+
+def serve_async():
+    """Run the async read endpoints (async_app.py) under uvicorn"""
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        print("[ERROR] uvicorn is not installed (pip install uvicorn)")
+        return False
+    bind = os.environ.get('ASYNC_BIND', '0.0.0.0:5001')
+    host, port = bind.rsplit(':', 1)
+    workers = os.environ.get('ASYNC_WORKERS', '1')
+    if int(workers) > 1:
+        # uvicorn workers share their metrics through a directory of their own,
+        # so a gunicorn restart (which clears METRICS_MULTIPROCESS_DIR) leaves them alone
+        metrics_dir = os.environ.get('ASYNC_METRICS_MULTIPROCESS_DIR',
+                                     os.path.join(tempfile.gettempdir(), 'subscription-async-metrics'))
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+        os.environ['METRICS_MULTIPROCESS_DIR'] = metrics_dir
+    print(f"[START] Starting async read endpoints on {bind} ({workers} worker(s))...")
+    os.execv(sys.executable, [sys.executable, '-m', 'uvicorn', '--factory', 'async_app:create_async_app',
+                              '--host', host, '--port', port, '--workers', workers, '--no-access-log'])
+
+def reload_production():
+    """Gracefully restart the gunicorn workers"""
+    pidfile = os.environ.get('GUNICORN_PIDFILE', 'gunicorn.pid')
+    try:
+        with open(pidfile) as handle:
+            pid = int(handle.read().strip())
+        os.kill(pid, signal.SIGHUP)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Could not signal the server from {pidfile}: {e}")
+        return False
+    print(f"[OK] Sent HUP to gunicorn master {pid}; workers restart as they finish their requests")
+    return True
+
 def open_browser():
     """Open browser to the application"""
     def open_url():
@@ -221,6 +271,12 @@ def main():
             handle_choice('2')
         elif command == 'run':
             handle_choice('3')
+        elif command == 'serve':
+            serve_production()
+        elif command == 'serve-async':
+            serve_async()
+        elif command == 'reload':
+            reload_production()
         elif command == 'test':
             handle_choice('4')
         elif command == 'performance':
@@ -233,7 +289,10 @@ def main():
             print("Available commands:")
             print("  start/quick - Quick start (setup + run)")
             print("  setup - Run setup only")
-            print("  run - Start application")
+            print("  run - Start application (development server)")
+            print("  serve - Start production server (gunicorn)")
+            print("  serve-async - Start async read endpoints (uvicorn)")
+            print("  reload - Gracefully restart production workers")
             print("  test - Run test suite")
             print("  performance - Run performance tests")
             print("  sample - Create sample data")
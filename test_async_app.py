@@ -0,0 +1,38 @@
+# test_async_app.py - The ASGI read endpoints answer like the Flask routes
+import asyncio
+import importlib
+
+import httpx
+
+import app as app_module
+import async_app
+from models import Coupon, db
+
+
+def test_import_does_not_build_the_app():
+    jobs = dict(app_module.background_jobs.jobs)
+    module = importlib.reload(async_app)
+    assert 'app' not in vars(module)
+    assert app_module.background_jobs.jobs == jobs
+
+
+def test_coupon_codes_are_decoded_once(make_app):
+    flask_app = make_app()
+    with flask_app.app_context():
+        db.session.add_all([Coupon(code='A%B', discount_type='percentage', discount_value=10),
+                            Coupon(code='A%41', discount_type='percentage', discount_value=20)])
+        db.session.commit()
+    asgi_app = async_app.AsyncReadApp(flask_app.config)
+    client = flask_app.test_client()
+
+    async def compare():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as async_client:
+            for path in ('/api/coupons/A%25B/validate', '/api/coupons/A%2541/validate'):
+                response = await async_client.post(path)
+                expected = client.post(path)
+                assert (response.status_code, response.json()) == (expected.status_code, expected.get_json())
+                assert response.json()['valid'] is True
+        await asgi_app.stop()
+
+    asyncio.run(compare())
@@ -270,9 +270,26 @@ class SubscriptionAPITester:
         
         for usage in usage_events:
             result = self.make_request('POST', f'/api/subscriptions/{self.subscription_id}/usage', usage)
-            if result and 'current_period_usage' in result:
+            # Pre-aggregated events have no usage_id until the next flush
+            if result and 'current_period_usage' in result and (result.get('usage_id') or result.get('aggregated')):
                 print(f"✅ Usage recorded: {usage['metric_name']} = {usage['quantity']}")
         
+        # Record a batch of usage events
+        batch_data = {"events": [
+            {"subscription_id": self.subscription_id, "metric_name": "api_calls", "quantity": 10},
+            {"subscription_id": self.subscription_id, "metric_name": "api_calls", "quantity": -1}
+        ]}
+        batch_result = self.make_request('POST', '/api/usage/batch', batch_data)
+        if batch_result and batch_result.get('accepted') == 1 and batch_result.get('rejected') == 1:
+            print("✅ Batch usage recorded with per-event errors")
+        
+        # A retried event with the same idempotency key is only counted once
+        retry_event = {"metric_name": "api_calls", "quantity": 1, "idempotency_key": f"retry-{int(time.time())}"}
+        self.make_request('POST', f'/api/subscriptions/{self.subscription_id}/usage', retry_event)
+        retry_result = self.make_request('POST', f'/api/subscriptions/{self.subscription_id}/usage', retry_event)
+        if retry_result and retry_result.get('duplicate'):
+            print("✅ Retried usage event deduplicated")
+        
         # Get usage stats
         stats_result = self.make_request('GET', f'/api/subscriptions/{self.subscription_id}/usage')
         if stats_result and 'usage_stats' in stats_result:
@@ -281,6 +298,58 @@ class SubscriptionAPITester:
         
         return False
     
+    def test_usage_deduplication(self):
+        print("\n" + "="*60)
+        print("TESTING USAGE DEDUPLICATION")
+        print("="*60)
+
+        if not self.subscription_id:
+            print("❌ No subscription ID available")
+            return False
+
+        prefix = f"dedup-{int(time.time() * 1000)}"
+        events = [
+            {"subscription_id": self.subscription_id, "metric_name": "api_calls", "quantity": 1,
+             "idempotency_key": f"{prefix}-{i % 3}"}
+            for i in range(5)
+        ]
+        ok = True
+
+        # Repeated keys inside one batch are accepted once
+        first = self.make_request('POST', '/api/usage/batch', {"events": events})
+        if first and first.get('accepted') == 3 and first.get('duplicates') == 2:
+            print("✅ Duplicate keys within a batch dropped")
+        else:
+            print("❌ Duplicate keys within a batch not dropped")
+            ok = False
+
+        # Retrying the whole batch accepts nothing
+        retry = self.make_request('POST', '/api/usage/batch', {"events": events})
+        if retry and retry.get('accepted') == 0 and retry.get('duplicates') == 5:
+            print("✅ Retried batch deduplicated")
+        else:
+            print("❌ Retried batch was counted again")
+            ok = False
+
+        # A key already accepted through the batch endpoint is a duplicate on the single-event one
+        single = self.make_request('POST', f'/api/subscriptions/{self.subscription_id}/usage',
+                                   {"metric_name": "api_calls", "quantity": 1, "idempotency_key": f"{prefix}-0"})
+        if single and single.get('duplicate'):
+            print("✅ Key shared across endpoints deduplicated")
+        else:
+            print("❌ Key shared across endpoints counted again")
+            ok = False
+
+        # A new key is still accepted after the duplicates
+        fresh = self.make_request('POST', '/api/usage/batch', {"events": [dict(events[0], idempotency_key=f"{prefix}-new")]})
+        if fresh and fresh.get('accepted') == 1:
+            print("✅ New key accepted after duplicates")
+        else:
+            print("❌ New key rejected")
+            ok = False
+
+        return ok
+
     def test_search_and_filtering(self):
         print("\n" + "="*60)
         print("TESTING SEARCH AND FILTERING")
@@ -295,7 +364,7 @@ class SubscriptionAPITester:
         
         for search_params in search_tests:
             result = self.make_request('GET', '/api/subscriptions/search', params=search_params)
-            if result and 'subscriptions' in result:
+            if isinstance(result, list):
                 print(f"✅ Search with params {search_params} successful")
         
         return True
@@ -315,6 +384,11 @@ class SubscriptionAPITester:
         if subscription_result and 'status_breakdown' in subscription_result:
             print("✅ Subscription dashboard successful")
         
+        # Test time-series dashboard
+        timeseries_result = self.make_request('GET', '/api/dashboard/timeseries', params={"granularity": "week"})
+        if timeseries_result and 'series' in timeseries_result:
+            print("✅ Time-series dashboard successful")
+        
         return True
     
     def test_bulk_operations(self):
@@ -377,6 +451,19 @@ class SubscriptionAPITester:
         
         return True
     
+    def test_metrics_endpoint(self):
+        print("\n" + "="*60)
+        print("TESTING METRICS ENDPOINT")
+        print("="*60)
+
+        result = self.make_request('GET', '/metrics')
+        text = (result or {}).get('raw_response', '')
+        if 'http_requests_total{' in text and 'http_request_duration_seconds_bucket{' in text:
+            print("✅ Prometheus metrics exposed")
+            return True
+        print("[ERROR] /metrics did not return request metrics")
+        return False
+
     def test_error_scenarios(self):
         print("\n" + "="*60)
         print("TESTING ERROR SCENARIOS")
@@ -429,11 +516,13 @@ class SubscriptionAPITester:
             ("Subscription with Coupon", lambda: self.test_create_subscription(use_coupon=True)),
             ("Subscription Operations", self.test_subscription_operations),
             ("Usage Tracking", self.test_usage_tracking),
+            ("Usage Deduplication", self.test_usage_deduplication),
             ("Search and Filtering", self.test_search_and_filtering),
             ("Dashboard Endpoints", self.test_dashboard_endpoints),
             ("Bulk Operations", self.test_bulk_operations),
             ("Export Functionality", self.test_export_functionality),
             ("Error Scenarios", self.test_error_scenarios),
+            ("Metrics Endpoint", self.test_metrics_endpoint),
         ]
         
         passed_tests = 0
@@ -523,6 +612,32 @@ def run_performance_tests():
             if avg_time > 1000:
                 print(f"   ⚠️  Slow response detected!")
 
+    print_server_latency(tester, [endpoint for _, endpoint in endpoints])
+
+def server_latency(metrics_text, route, quantile):
+    """Upper bucket bound holding the ``quantile`` of a route's server-side GET latency"""
+    buckets = []
+    prefix = f'http_request_duration_seconds_bucket{{method="GET",route="{route}",le="'
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix):
+            bound, count = line[len(prefix):].split('"} ')
+            buckets.append((float(bound.replace('+Inf', 'inf')), int(count)))
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    target = quantile * buckets[-1][1]
+    return next(bound for bound, count in buckets if count >= target)
+
+def print_server_latency(tester, routes):
+    """Print p50/p95 per route from the server's own /metrics histograms"""
+    result = tester.make_request('GET', '/metrics')
+    text = (result or {}).get('raw_response', '')
+    print("\n📊 Server-side latency (all requests since start, /metrics):")
+    for route in routes:
+        p50, p95 = server_latency(text, route, 0.5), server_latency(text, route, 0.95)
+        if p50 is None:
+            continue
+        print(f"   GET {route}: p50 <= {p50 * 1000:g}ms, p95 <= {p95 * 1000:g}ms")
+
 def simulate_load_test(num_concurrent_users=10):
     """Simulate concurrent users to test system under load"""
     print(f"\n" + "="*80)
@@ -0,0 +1,41 @@
+# test_dedup.py - Time-windowed Bloom filters for idempotency keys
+from dedup import RotatingBloomFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_are_remembered_for_the_window():
+    clock = Clock()
+    bloom = RotatingBloomFilter(30, 1000, generations=4, clock=clock)
+    bloom.add(['a'])
+    clock.now += 30
+    assert bloom.might_contain(['a', 'b']).tolist() == [True, False]
+
+
+def test_rotation_keeps_whole_slices_when_checks_arrive_late():
+    clock = Clock()
+    bloom = RotatingBloomFilter(30, 1000, generations=4, clock=clock)
+    bloom.add(['a'])  # its generation covers [1000, 1010)
+    # Checks landing 0.9s into a slice must not push later slice boundaries back
+    for _ in range(3):
+        clock.now += 10.9
+        bloom.might_contain(['x'])
+    clock.now = 1000 + 4 * bloom.slice_seconds + 1
+    assert bloom.might_contain(['a']).tolist() == [False]
+
+
+def test_idle_filter_forgets_everything():
+    clock = Clock()
+    bloom = RotatingBloomFilter(30, 1000, generations=4, clock=clock)
+    bloom.add(['a'])
+    clock.now += 1000
+    assert bloom.might_contain(['a']).tolist() == [False]
+    bloom.add(['b'])
+    clock.now += 25
+    assert bloom.might_contain(['b']).tolist() == [True]
@@ -0,0 +1,31 @@
+# test_exports.py - Delta exports of subscription changes and deletions
+from models import Subscription, SubscriptionTombstone, db
+
+
+def delta(client, since='0'):
+    response = client.get('/api/export/subscriptions', query_string={'since': since, 'format': 'json'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_bulk_and_core_deletes_leave_tombstones(make_app, make_subscription):
+    app = make_app(DELTA_EXPORT_LAG_SECONDS=0)
+    client = app.test_client()
+    with app.app_context():
+        ids = [make_subscription() for _ in range(4)]
+        Subscription.query.filter(Subscription.id.in_(ids[:2])).delete(synchronize_session=False)
+        db.session.execute(db.delete(Subscription.__table__).where(Subscription.id == ids[2]))
+        db.session.commit()
+        assert sorted(row.subscription_id for row in SubscriptionTombstone.query) == ids[:3]
+
+    rows = delta(client)
+    assert [row['id'] for row in rows if not row['deleted']] == ids[3:]
+    assert sorted(row['id'] for row in rows if row['deleted']) == ids[:3]
+
+
+def test_orm_delete_leaves_one_tombstone(app, make_subscription):
+    with app.app_context():
+        subscription_id = make_subscription()
+        db.session.delete(db.session.get(Subscription, subscription_id))
+        db.session.commit()
+        assert [row.subscription_id for row in SubscriptionTombstone.query] == [subscription_id]
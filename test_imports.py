@@ -0,0 +1,24 @@
+# test_imports.py - Streaming bulk imports
+import app as app_module
+
+
+def test_rejects_are_listed_in_line_order(app, monkeypatch):
+    client = app.test_client()
+    lines = [
+        '{"email": "a@example.com", "name": "A"}',
+        '{"email": "a@example.com", "name": "Duplicate of line 1"}',  # rejected when its batch is inserted
+        '{"email": "b@example.com"',  # rejected while parsing
+        '{"name": "No email"}',  # rejected by the schema
+        '{"email": "c@example.com", "name": "C"}',
+    ]
+    response = client.post('/api/import/users', data='\n'.join(lines), content_type='application/x-ndjson')
+    result = response.get_json()
+    assert (result['imported'], result['rejected']) == (2, 3)
+    assert [error['line'] for error in result['errors']] == [2, 3, 4]
+
+    # Past the cap, the lowest lines are kept
+    monkeypatch.setattr(app_module, 'MAX_IMPORT_ERRORS', 2)
+    response = client.post('/api/import/users', data='\n'.join(lines), content_type='application/x-ndjson')
+    result = response.get_json()
+    assert result['rejected'] == 5
+    assert [error['line'] for error in result['errors']] == [1, 2]
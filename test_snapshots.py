@@ -0,0 +1,38 @@
+# test_snapshots.py - `flask snapshot` and `flask restore` round trips
+from datetime import datetime
+
+from models import Subscription, UsageLog, db
+
+
+def table_rows():
+    return {table.name: sorted(map(tuple, db.session.execute(db.select(table)).all()), key=repr)
+            for table in db.metadata.sorted_tables}
+
+
+def test_snapshot_restores_every_row(make_app, make_subscription, tmp_path):
+    source = make_app()
+    with source.app_context():
+        ids = [make_subscription() for _ in range(3)]
+        db.session.add_all([
+            UsageLog(subscription_id=ids[0], metric_name='api_calls', quantity=1.5, event_count=3,
+                     extra_data={'region': 'eu'}, timestamp=datetime(2026, 3, 1, 3, 30, 41, 123456)),
+            UsageLog(subscription_id=ids[1], metric_name='storage_gb', quantity=2.0, timestamp=datetime(2026, 3, 2)),
+        ])
+        db.session.delete(db.session.get(Subscription, ids[2]))
+        db.session.commit()
+        expected = table_rows()
+    result = source.test_cli_runner().invoke(args=['snapshot', '--output', str(tmp_path / 'snapshot')])
+    assert result.exit_code == 0, result.output
+
+    target = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'restored.db'}")
+    result = target.test_cli_runner().invoke(args=['restore', str(tmp_path / 'snapshot')])
+    assert result.exit_code == 0, result.output
+    with target.app_context():
+        assert table_rows() == expected
+        assert len(expected['subscription_tombstone']) == 1
+
+    # Replacing a populated database leaves no tombstones for the subscriptions it cleared
+    result = target.test_cli_runner().invoke(args=['restore', '--replace', str(tmp_path / 'snapshot')])
+    assert result.exit_code == 0, result.output
+    with target.app_context():
+        assert table_rows() == expected
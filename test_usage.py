@@ -0,0 +1,219 @@
+# test_usage.py - Usage aggregation, billing period attribution and ingestion
+import os
+from datetime import datetime, timedelta
+
+import app as app_module
+import usage
+from models import UsageLog, UsageRollupDaily, db
+
+PERIOD_START = datetime(2026, 3, 1, 3, 30, 41)
+
+
+def test_bucket_start_cuts_at_period_boundary():
+    assert usage.bucket_start(datetime(2026, 3, 1, 3, 30, 45), 60) == datetime(2026, 3, 1, 3, 30)
+    assert usage.bucket_start(datetime(2026, 3, 1, 3, 30, 45), 60, (PERIOD_START,)) == PERIOD_START
+    assert usage.bucket_start(datetime(2026, 3, 1, 3, 30, 41), 60, (PERIOD_START,)) == PERIOD_START
+    assert usage.bucket_start(datetime(2026, 3, 1, 3, 30, 20), 60, (PERIOD_START,)) == datetime(2026, 3, 1, 3, 30)
+    assert usage.bucket_start(datetime(2026, 3, 1, 3, 31, 5), 60, (PERIOD_START, None)) == datetime(2026, 3, 1, 3, 31)
+
+
+def test_aggregated_usage_is_counted_in_the_period_of_its_events(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription(PERIOD_START)
+    events = [
+        {'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 4, 'timestamp': '2026-03-01T03:30:20'},
+        {'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 5, 'timestamp': '2026-03-01T03:30:45'},
+        {'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 10, 'timestamp': '2026-03-01T03:30:50'},
+    ]
+    assert client.post('/api/usage/batch', json={'events': events}).status_code == 201
+    with app.app_context():
+        app_module.flush_usage_aggregator()
+        rows = sorted((row.timestamp, row.quantity, row.event_count) for row in UsageLog.query)
+    assert rows == [(datetime(2026, 3, 1, 3, 30), 4, 1), (PERIOD_START, 15, 2)]
+
+    stats = client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()
+    assert stats['current_period_usage'] == {'api_calls': 15}
+    previous = client.get(f'/api/subscriptions/{subscription_id}/usage',
+                          query_string={'start': '2026-03-01T03:00:00', 'end': PERIOD_START.isoformat()}).get_json()
+    assert previous['current_period_usage'] == {'api_calls': 4}
+
+
+def test_recovered_journal_keeps_period_cuts(tmp_path):
+    flushed = []
+    dead = usage.UsageAggregator(flushed.extend, str(tmp_path))
+    periods = {1: (PERIOD_START, PERIOD_START + timedelta(days=30))}
+    dead.add([
+        {'subscription_id': 1, 'metric_name': 'api_calls', 'quantity': 2.0, 'timestamp': datetime(2026, 3, 1, 3, 30, 20)},
+        {'subscription_id': 1, 'metric_name': 'api_calls', 'quantity': 3.0, 'timestamp': datetime(2026, 3, 1, 3, 30, 50)},
+    ], periods)
+    # The process dies without flushing: its journal lock is released, the journal stays
+    dead._journal.close()
+    dead._lock_file.close()
+
+    survivor = usage.UsageAggregator(flushed.extend, str(tmp_path))
+    assert survivor.recover() == 2
+    assert sorted((row['timestamp'], row['quantity'], row['event_count']) for row in flushed) == [
+        (datetime(2026, 3, 1, 3, 30), 2.0, 1), (PERIOD_START, 3.0, 1)]
+    assert not [name for name in os.listdir(tmp_path) if dead.owner in name]
+    survivor.close()
+
+
+def test_single_event_reports_pending_aggregated_usage(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription()
+
+    response = client.post(f'/api/subscriptions/{subscription_id}/usage', json={'metric_name': 'api_calls', 'quantity': 15})
+    result = response.get_json()
+    assert response.status_code == 201
+    assert result['aggregated'] is True and result['usage_id'] is None
+    assert result['current_period_usage'] == {'api_calls': 15}
+    stats = client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()
+    assert stats['usage_stats'] == [{'metric_name': 'api_calls', 'total_quantity': 15, 'event_count': 1}]
+
+    with app.app_context():
+        app_module.flush_usage_aggregator()
+    stats = client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()
+    assert stats['usage_stats'] == [{'metric_name': 'api_calls', 'total_quantity': 15, 'event_count': 1}]
+
+
+def test_single_event_returns_usage_id_for_raw_rows(app, make_subscription):
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription()
+
+    result = client.post(f'/api/subscriptions/{subscription_id}/usage', json={'metric_name': 'api_calls', 'quantity': 2}).get_json()
+    assert result['aggregated'] is False and result['usage_id'] == 1
+    assert result['current_period_usage'] == {'api_calls': 2}
+
+
+def test_usage_summary_splits_rollups_at_a_period_start(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription(PERIOD_START)
+    timestamps = ['2026-02-28T23:10:00', '2026-03-01T03:05:00', '2026-03-01T03:30:20', '2026-03-01T03:30:45',
+                  '2026-03-01T03:59:59', '2026-03-01T05:15:00', '2026-03-02T10:00:00', '2026-03-05T00:00:00',
+                  '2026-03-30T23:30:00', '2026-03-31T03:30:40', '2026-03-31T03:30:41']
+    events = [{'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 2 ** index, 'timestamp': timestamp}
+              for index, timestamp in enumerate(timestamps)]
+    assert client.post('/api/usage/batch', json={'events': events}).get_json()['accepted'] == len(events)
+
+    def expected(start, end):
+        return sum(event['quantity'] for event in events if start <= datetime.fromisoformat(event['timestamp']) < end)
+
+    def summed(start, end):
+        return app_module.usage_summary(subscription_id, start, end).get('api_calls', {}).get('total_quantity', 0)
+
+    period_end = PERIOD_START + timedelta(days=30)
+    ranges = [(PERIOD_START, period_end), (PERIOD_START - timedelta(days=2), PERIOD_START),
+              (PERIOD_START - timedelta(hours=1), PERIOD_START + timedelta(hours=3))]
+    with app.app_context():
+        app_module.flush_usage_aggregator()
+        for _ in range(2):  # the first run only records the horizon
+            app_module.rollup_usage()
+            for start, end in ranges:
+                assert summed(start, end) == expected(start, end)
+        rolled_up = db.session.query(db.func.sum(UsageRollupDaily.quantity)).scalar()
+    assert rolled_up == sum(event['quantity'] for event in events)
+
+
+def test_retried_batch_only_accepts_new_keys(app, make_subscription):
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription()
+
+    def batch(keys):
+        return client.post('/api/usage/batch', json={'events': [
+            {'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 1, 'idempotency_key': key}
+            for key in keys]}).get_json()
+
+    assert batch(['a', 'b'])['accepted'] == 2
+    retry = batch(['a', 'b', 'c', 'c'])
+    assert (retry['accepted'], retry['duplicates']) == (1, 3)
+    # Another worker's filters have not seen the keys; the table still rejects them
+    app_module._idempotency_filter = None
+    retry = batch(['a', 'c', 'd'])
+    assert (retry['accepted'], retry['duplicates']) == (1, 2)
+    stats = client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()
+    assert stats['current_period_usage'] == {'api_calls': 4}
+
+
+def test_quota_counts_aggregated_usage_before_and_after_a_flush(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription(PERIOD_START, limits={'api_calls': 20})
+
+    def used():
+        return client.get(f'/api/subscriptions/{subscription_id}/quota/api_calls').get_json()['used']
+
+    def record(quantity, second):
+        client.post(f'/api/subscriptions/{subscription_id}/usage', json={
+            'metric_name': 'api_calls', 'quantity': quantity, 'timestamp': f'2026-03-01T03:30:{second}'})
+
+    record(5, 45)
+    assert used() == 5  # cold cache: loaded from the pending buckets, not counted twice
+    record(10, 50)
+    assert used() == 15
+    with app.app_context():
+        app_module.flush_usage_aggregator()
+    assert used() == 15
+    # A cold cache or a TTL reload right after the flush reads the flushed rows
+    app_module.quota_cache.invalidate_subscription(subscription_id)
+    assert used() == 15
+    record(10, 55)
+    quota = client.get(f'/api/subscriptions/{subscription_id}/quota/api_calls').get_json()
+    assert (quota['used'], quota['over_quota']) == (25, True)
+
+
+def test_failed_flush_keeps_buffered_usage_for_the_next_one(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    client = app.test_client()
+    with app.app_context():
+        subscription_id = make_subscription()
+    client.post(f'/api/subscriptions/{subscription_id}/usage', json={'metric_name': 'api_calls', 'quantity': 3})
+    aggregator = app_module._usage_aggregator
+    flush_rows = aggregator.flush_rows
+
+    def unavailable(rows):
+        raise RuntimeError('database unavailable')
+
+    aggregator.flush_rows = unavailable
+    with app.app_context():
+        try:
+            app_module.flush_usage_aggregator()
+        except RuntimeError:
+            pass
+        assert UsageLog.query.count() == 0
+    assert aggregator.status()['pending_journals'] == 1
+    usage_now = client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()['current_period_usage']
+    assert usage_now == {'api_calls': 3}
+
+    aggregator.flush_rows = flush_rows
+    client.post(f'/api/subscriptions/{subscription_id}/usage', json={'metric_name': 'api_calls', 'quantity': 4})
+    with app.app_context():
+        app_module.flush_usage_aggregator()
+        assert [(row.quantity, row.event_count) for row in UsageLog.query] == [(7, 2)]
+    assert aggregator.status()['pending_journals'] == 0
+    assert client.get(f'/api/subscriptions/{subscription_id}/usage').get_json()['current_period_usage'] == {'api_calls': 7}
+
+
+def test_new_worker_recovers_a_dead_workers_journal(make_app, make_subscription):
+    app = make_app(USAGE_AGGREGATION_ENABLED=True)
+    with app.app_context():
+        subscription_id = make_subscription(PERIOD_START)
+    dead = usage.UsageAggregator(lambda rows: None, app.config['USAGE_JOURNAL_DIR'])
+    dead.add([{'subscription_id': subscription_id, 'metric_name': 'api_calls', 'quantity': 6.0,
+               'timestamp': PERIOD_START + timedelta(seconds=5)}], {subscription_id: (PERIOD_START, None)})
+    dead._journal.close()
+    dead._lock_file.close()
+
+    with app.app_context():
+        app_module.get_usage_aggregator()  # the first use replays journals of dead workers
+        assert [(row.timestamp, row.quantity) for row in UsageLog.query] == [(PERIOD_START, 6)]
+    stats = app.test_client().get(f'/api/subscriptions/{subscription_id}/usage').get_json()
+    assert stats['current_period_usage'] == {'api_calls': 6}
@@ -0,0 +1,414 @@
+# usage.py - Usage event validation and batching helpers
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+try:
+    import fcntl
+except ImportError:  # Windows: journals can only be recovered by a single process
+    fcntl = None
+
+MAX_METRIC_NAME_LENGTH = 100
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# Largest number of events accepted by a single batch request
+MAX_BATCH_EVENTS = 10000
+# Longest single event line accepted by the NDJSON stream endpoint
+MAX_STREAM_LINE_BYTES = 64 * 1024
+# Subscription ids are validated as int64; larger ones cannot exist
+MAX_SUBSCRIPTION_ID = 2 ** 63 - 1
+
+
+def parse_timestamp(value, now):
+    """Parse an event timestamp (ISO-8601 string or epoch seconds) to naive UTC"""
+    if value is None:
+        return now
+    if isinstance(value, bool):
+        raise ValueError('invalid timestamp')
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    raise ValueError('invalid timestamp')
+
+
+def _as_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return np.nan
+    return float(value)
+
+
+def _as_id(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= MAX_SUBSCRIPTION_ID:
+        return -1
+    return value
+
+
+def validate_events(events, existing_subscription_ids, default_subscription_id=None, now=None):
+    """Validate a batch of usage events column-wise.
+
+    ``existing_subscription_ids(ids)`` is called once with the distinct
+    subscription ids of the batch and returns the ones that exist. Returns
+    ``(rows, errors)``: insertable row dicts for the valid events and
+    ``{'index': i, 'error': message}`` for every rejected event (the first
+    failing check wins). Rows carry the event's ``idempotency_key`` (or None),
+    which is not a UsageLog column and must be removed before inserting.
+    """
+    now = now or datetime.utcnow()
+    count = len(events)
+    is_dict = np.fromiter((isinstance(event, dict) for event in events), dtype=bool, count=count)
+    events = [event if ok else {} for event, ok in zip(events, is_dict)]
+
+    if default_subscription_id is not None:
+        subscription_ids = np.full(count, default_subscription_id, dtype=np.int64)
+    else:
+        subscription_ids = np.fromiter((_as_id(e.get('subscription_id')) for e in events), dtype=np.int64, count=count)
+    quantities = np.fromiter((_as_float(e.get('quantity')) for e in events), dtype=np.float64, count=count)
+    metric_names = [e.get('metric_name') for e in events]
+    metric_ok = np.fromiter(
+        (isinstance(name, str) and 0 < len(name) <= MAX_METRIC_NAME_LENGTH for name in metric_names),
+        dtype=bool, count=count)
+    metadata_ok = np.fromiter(
+        (e.get('metadata') is None or isinstance(e.get('metadata'), dict) for e in events), dtype=bool, count=count)
+    idempotency_keys = [e.get('idempotency_key') for e in events]
+    key_ok = np.fromiter(
+        (key is None or (isinstance(key, str) and 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH)
+         for key in idempotency_keys), dtype=bool, count=count)
+
+    candidates = np.unique(subscription_ids[subscription_ids > 0])
+    existing = np.fromiter(existing_subscription_ids(candidates.tolist()) if len(candidates) else (), dtype=np.int64)
+    subscription_ok = np.isin(subscription_ids, existing)
+    quantity_ok = np.isfinite(quantities) & (quantities > 0)
+
+    timestamps = [None] * count
+    timestamp_ok = np.ones(count, dtype=bool)
+    for index, event in enumerate(events):
+        try:
+            timestamps[index] = parse_timestamp(event.get('timestamp'), now)
+        except (ValueError, TypeError, OverflowError, OSError):
+            timestamp_ok[index] = False
+
+    checks = (
+        (is_dict, 'Event must be an object'),
+        (subscription_ok, 'Subscription not found'),
+        (metric_ok, f'metric_name must be a non-empty string of at most {MAX_METRIC_NAME_LENGTH} characters'),
+        (quantity_ok, 'Valid quantity is required'),
+        (timestamp_ok, 'Invalid timestamp'),
+        (metadata_ok, 'metadata must be an object'),
+        (key_ok, f'idempotency_key must be a non-empty string of at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters'),
+    )
+    valid = np.ones(count, dtype=bool)
+    errors = {}
+    for ok, message in checks:
+        for index in np.flatnonzero(valid & ~ok).tolist():
+            errors[index] = message
+        valid &= ok
+
+    rows = [{
+        'subscription_id': int(subscription_ids[index]),
+        'metric_name': metric_names[index],
+        'quantity': float(quantities[index]),
+        'extra_data': events[index].get('metadata'),
+        'timestamp': timestamps[index],
+        'idempotency_key': idempotency_keys[index],
+    } for index in np.flatnonzero(valid).tolist()]
+    return rows, [{'index': index, 'error': errors[index]} for index in sorted(errors)]
+
+
+def iter_ndjson(stream, loads=json.loads, chunk_size=64 * 1024, max_line_bytes=MAX_STREAM_LINE_BYTES):
+    """Parse newline-delimited JSON from a file-like ``stream`` incrementally.
+
+    Yields ``(line_number, event, error)`` for every non-blank line, with
+    either ``event`` or an ``error`` message set. Memory is bounded by
+    ``chunk_size + max_line_bytes`` no matter how long the stream is; longer
+    lines are reported and skipped.
+    """
+    buffer = b''
+    line_number = 0
+    skipping = False  # inside an overlong line that was already reported
+    while True:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            buffer += chunk
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+        else:
+            lines, buffer = ([buffer] if buffer else []), b''
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_number, loads(line), None
+            except ValueError:
+                yield line_number, None, 'Invalid JSON'
+        if len(buffer) > max_line_bytes:
+            if not skipping:
+                line_number += 1
+                yield line_number, None, f'Line exceeds {max_line_bytes} bytes'
+            buffer, skipping = b'', True
+        if not chunk:
+            return
+
+
+def bucket_start(timestamp, bucket_seconds, cuts=()):
+    """Start of the ``bucket_seconds``-wide time bucket containing ``timestamp``.
+
+    ``cuts`` are billing period boundaries: a bucket containing one is split
+    there, so events from the boundary on get a bucket starting at the
+    boundary itself and never share a row with the previous period.
+    """
+    epoch = int(timestamp.replace(tzinfo=timezone.utc).timestamp())
+    start = datetime.fromtimestamp(epoch - epoch % bucket_seconds, tz=timezone.utc).replace(tzinfo=None)
+    for cut in cuts:
+        if cut is not None and start < cut <= timestamp:
+            start = cut
+    return start
+
+
+class UsageAggregator:
+    """Sums usage events per (subscription, metric, time bucket) in memory.
+
+    Every accepted event is first appended to a per-process journal file, so
+    the in-memory sums can always be rebuilt after a crash. ``flush()`` swaps
+    the buffer out, renames the journal to a pending file, hands the
+    aggregated rows to ``flush_rows`` and deletes the pending file only after
+    that call returned. A crash between the write and the delete replays the
+    journal again, so delivery is at-least-once.
+
+    Rows are stamped with their bucket's start. Buckets are cut at the
+    period boundaries passed to ``add()``, so every row falls in the billing
+    period of all of its events.
+
+    A process holds an exclusive lock on its own journal for its lifetime;
+    ``recover()`` replays journals of processes that no longer hold theirs.
+    """
+
+    def __init__(self, flush_rows, journal_dir, bucket_seconds=60, max_keys=10000, fsync=False):
+        self.flush_rows = flush_rows
+        self.journal_dir = journal_dir
+        self.bucket_seconds = bucket_seconds
+        self.max_keys = max_keys
+        self.fsync = fsync
+        self.pid = os.getpid()
+        self.owner = f"{self.pid}-{uuid.uuid4().hex[:8]}"
+        self.events_buffered = 0
+        self.rows_flushed = 0
+        self.last_flush = None
+        self._buckets = {}
+        self._pending_files = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(journal_dir, f"owner-{self.owner}.lock"), 'w')
+        try_lock(self._lock_file)
+        self._journal_path = os.path.join(journal_dir, f"active-{self.owner}.jsonl")
+        self._journal = open(self._journal_path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def add(self, rows, periods=None):
+        """Journal and buffer validated usage rows; True when the buffer is full and should be flushed.
+
+        ``periods`` maps subscription ids to their ``(period_start,
+        period_end)``; buckets are cut at those boundaries.
+        """
+        return self._add(rows, 1, periods)
+
+    def retract(self, rows, periods=None):
+        """Take back rows passed to ``add()`` (their transaction failed).
+
+        The retraction is journaled too. Sums not flushed yet cancel out; if a
+        flush ran in between, the next one writes the negated amounts.
+        """
+        self._add(rows, -1, periods)
+
+    def _add(self, rows, sign, periods):
+        if not rows:
+            return False
+        periods = periods or {}
+        lines = []
+        with self._lock:
+            for row in rows:
+                timestamp = row['timestamp']
+                plain = bucket_start(timestamp, self.bucket_seconds)
+                start = bucket_start(timestamp, self.bucket_seconds, periods.get(row['subscription_id'], ()))
+                record = [row['subscription_id'], row['metric_name'], sign * row['quantity'], timestamp.isoformat()]
+                if start != plain:
+                    record += [sign, start.isoformat()]  # event count and the cut bucket start
+                elif sign < 0:
+                    record.append(sign)  # event count; omitted for the usual +1
+                lines.append(json.dumps(record, separators=(',', ':')))
+                key = (row['subscription_id'], row['metric_name'], start)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    self._buckets[key] = [sign * row['quantity'], sign]
+                else:
+                    bucket[0] += sign * row['quantity']
+                    bucket[1] += sign
+            self._journal.write('\n'.join(lines) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self.events_buffered += sign * len(rows)
+            return len(self._buckets) >= self.max_keys
+
+    def pending(self, subscription_id, start, end):
+        """``{metric: [quantity, event_count]}`` buffered for a subscription in ``[start, end)``.
+
+        Buckets being flushed are in neither the buffer nor the database
+        until the flush returns; read both inside ``paused()`` to see every
+        event exactly once.
+        """
+        totals = {}
+        with self._lock:
+            for (bucket_subscription, metric_name, bucket), (quantity, count) in self._buckets.items():
+                if bucket_subscription == subscription_id and start <= bucket < end and count:
+                    total = totals.setdefault(metric_name, [0.0, 0])
+                    total[0] += quantity
+                    total[1] += count
+        return totals
+
+    @contextmanager
+    def paused(self):
+        """Hold off flushes for the duration of the block"""
+        with self._flush_lock:
+            yield
+
+    def flush(self):
+        """Write the buffered aggregates through ``flush_rows``; returns the row count"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buckets:
+                    return 0
+                buckets, self._buckets = self._buckets, {}
+                self._journal.close()
+                self._sequence += 1
+                pending = os.path.join(self.journal_dir, f"pending-{self.owner}-{self._sequence:06d}.jsonl")
+                os.replace(self._journal_path, pending)
+                self._pending_files.append(pending)
+                self._journal = open(self._journal_path, 'a', encoding='utf-8')
+
+            rows = _bucket_rows(buckets)
+            try:
+                self.flush_rows(rows)
+            except Exception:
+                # Keep the sums (and their pending journals) for the next attempt
+                with self._lock:
+                    for key, (quantity, count) in buckets.items():
+                        bucket = self._buckets.setdefault(key, [0.0, 0])
+                        bucket[0] += quantity
+                        bucket[1] += count
+                raise
+
+            with self._lock:
+                delivered, self._pending_files = self._pending_files, []
+            for path in delivered:
+                os.remove(path)
+            self.rows_flushed += len(rows)
+            self.last_flush = time.time()
+            return len(rows)
+
+    def recover(self):
+        """Replay journals left behind by processes that died; returns events replayed"""
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.startswith('owner-') or name == f"owner-{self.owner}.lock":
+                continue
+            owner = name[len('owner-'):-len('.lock')]
+            lock_path = os.path.join(self.journal_dir, name)
+            with open(lock_path, 'a') as lock_file:
+                if not try_lock(lock_file):
+                    continue  # owner is still alive
+                paths = sorted(
+                    os.path.join(self.journal_dir, journal) for journal in os.listdir(self.journal_dir)
+                    if journal.endswith('.jsonl') and (journal.startswith(f"active-{owner}.")
+                                                       or journal.startswith(f"pending-{owner}-"))
+                )
+                buckets = {}
+                for path in paths:
+                    replayed += _read_journal(path, buckets, self.bucket_seconds)
+                if buckets:
+                    self.flush_rows(_bucket_rows(buckets))
+                for path in paths:
+                    os.remove(path)
+            os.remove(lock_path)
+        return replayed
+
+    def close(self):
+        """Flush what is buffered and release the journal"""
+        self.flush()
+        with self._lock:
+            self._journal.close()
+            if os.path.getsize(self._journal_path) == 0:
+                os.remove(self._journal_path)
+        self._lock_file.close()
+        os.remove(self._lock_file.name)
+
+    def status(self):
+        return {
+            'owner': self.owner,
+            'buffered_keys': len(self._buckets),
+            'events_buffered': self.events_buffered,
+            'rows_flushed': self.rows_flushed,
+            'pending_journals': len(self._pending_files),
+            'last_flush': self.last_flush,
+        }
+
+
+def _bucket_rows(buckets):
+    """UsageLog rows for the buckets; buckets whose events were all retracted are skipped"""
+    return [{
+        'subscription_id': subscription_id,
+        'metric_name': metric_name,
+        'quantity': quantity,
+        'event_count': count,
+        'timestamp': start,
+        'extra_data': None,
+    } for (subscription_id, metric_name, start), (quantity, count) in buckets.items() if count]
+
+
+def _read_journal(path, buckets, bucket_seconds):
+    events = 0
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                subscription_id, metric_name, quantity, timestamp, *extra = json.loads(line)
+            except ValueError:
+                continue  # torn final line from the crash
+            if len(extra) > 1:
+                start = datetime.fromisoformat(extra[1])
+            else:
+                start = bucket_start(datetime.fromisoformat(timestamp), bucket_seconds)
+            bucket = buckets.setdefault((subscription_id, metric_name, start), [0.0, 0])
+            bucket[0] += quantity
+            bucket[1] += extra[0] if extra else 1
+            events += 1
+    return events
+
+
+def try_lock(handle):
+    """Take a non-blocking exclusive lock on ``handle``; True when acquired"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False